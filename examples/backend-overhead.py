@@ -0,0 +1,41 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import argparse
+import logging
+import time
+from myo_raw import MyoRaw, EMGMode
+
+parser = argparse.ArgumentParser()
+group = parser.add_mutually_exclusive_group()
+group.add_argument('--tty', default=None, help='The Myo dongle device (autodetected if omitted)')
+group.add_argument('--native', default=False, action='store_true', help='Use a native Bluetooth stack')
+parser.add_argument('--mac', default=None, help='The Myo MAC address (arbitrarily detected if omitted)')
+parser.add_argument('--duration', type=float, default=10, help='Measurement duration in seconds')
+parser.add_argument('-v', '--verbose', action='count', default=0, help='Increase verbosity')
+args = parser.parse_args()
+logging.basicConfig(level=max(2 - args.verbose, 0) * 10)
+
+myo = MyoRaw(args.tty, args.native, args.mac)
+myo.subscribe(EMGMode.RAW)
+myo.set_sleep_mode(1)
+
+# measure the CPU time of this process spent per received notification (note that the CPU time
+# of the bluepy-helper process used by the native backend is not included)
+try:
+    n0, cpu0, t0 = myo.backend.notifications, time.process_time(), time.time()
+    while time.time() < t0 + args.duration:
+        myo.run(0.1)
+    notifications = myo.backend.notifications - n0
+    cpu, elapsed = time.process_time() - cpu0, time.time() - t0
+    print('backend:       {}'.format(type(myo.backend).__name__))
+    print('notifications: {} ({:.1f} per second)'.format(notifications, notifications / elapsed))
+    print('CPU time:      {:.1f} us per notification'.format(1e6 * cpu / max(notifications, 1)))
+except KeyboardInterrupt:
+    pass
+finally:
+    myo.disconnect()
+    print('Disconnected')
@@ -6,15 +6,21 @@
 #
 
 from collections import Counter, deque
+import hashlib
+import os
+import pickle
 import sys
 import struct
 import numpy as np
 from myo_raw import MyoRaw, DataCategory, EMGMode
 try:
+    import sklearn
     from sklearn import neighbors, svm
     HAVE_SK = True
+    SK_VERSION = sklearn.__version__
 except ImportError:
     HAVE_SK = False
+    SK_VERSION = None
 try:
     import pygame
     from pygame.locals import *
@@ -24,10 +30,16 @@ except ImportError:
 
 SUBSAMPLE = 3
 K = 15
+# the fitted model is cached along with the size and hash of the training data it was fitted on
+CACHE = 'vals.model'
+# number of samples appended since the last fit before the model is fitted again
+REBUILD_TAIL = 500
 
 class NNClassifier(object):
     '''A wrapper for sklearn's nearest-neighbor classifier that stores
-    training data in vals0, ..., vals9.dat.'''
+    training data in vals0, ..., vals9.dat and caches the fitted model in
+    vals.model. Samples appended since the model was fitted (the tail) are
+    searched exhaustively and merged with the neighbors found by the kd-tree.'''
 
     def __init__(self):
         for i in range(10):
@@ -38,16 +50,73 @@ class NNClassifier(object):
         with open('vals%d.dat' % cls, 'ab') as f:
             f.write(struct.pack('<8H', *vals))
 
-        self.train(np.vstack([self.X, vals]), np.hstack([self.Y, [cls]]))
+        self.tail_X.append(vals)
+        self.tail_Y.append(cls)
+        if len(self.tail_X) >= REBUILD_TAIL:
+            self.rebuild()
 
     def read_data(self):
-        X = []
-        Y = []
+        data = []
         for i in range(10):
-            X.append(np.fromfile('vals%d.dat' % i, dtype=np.uint16).reshape((-1, 8)))
-            Y.append(i + np.zeros(X[-1].shape[0]))
+            with open('vals%d.dat' % i, 'rb') as f:
+                data.append(f.read())
+        cache = self.load_cache(data)
+        if cache is None:
+            X = [np.frombuffer(d, dtype=np.uint16).reshape((-1, 8)) for d in data]
+            Y = [i + np.zeros(x.shape[0]) for i, x in enumerate(X)]
+            self.tail_X, self.tail_Y = [], []
+            self.train(np.vstack(X), np.hstack(Y))
+            self.save_cache(data)
+            return
 
-        self.train(np.vstack(X), np.hstack(Y))
+        # only the samples appended after the cached ones need to be handled
+        self.X, self.Y, self.nn = cache['X'], cache['Y'], cache['nn']
+        self.tail_X, self.tail_Y = [], []
+        for i, d in enumerate(data):
+            tail = np.frombuffer(d[cache['sizes'][i]:], dtype=np.uint16).reshape((-1, 8))
+            self.tail_X.extend(tuple(int(v) for v in vals) for vals in tail)
+            self.tail_Y.extend([i] * tail.shape[0])
+        if len(self.tail_X) >= REBUILD_TAIL:
+            self.rebuild()
+
+    def load_cache(self, data):
+        '''Return the cache if all training files start with the data it was fitted on'''
+        try:
+            with open(CACHE, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            # any unreadable cache (e.g. a model pickled by another scikit-learn) is refitted
+            return None
+        if cache.get('K') != K or cache.get('SUBSAMPLE') != SUBSAMPLE or cache.get('SK_VERSION') != SK_VERSION:
+            return None
+        for d, size, digest in zip(data, cache['sizes'], cache['digests']):
+            if len(d) < size or hashlib.sha256(d[:size]).hexdigest() != digest:
+                return None
+        return cache
+
+    def save_cache(self, data):
+        cache = {
+            'K': K, 'SUBSAMPLE': SUBSAMPLE, 'SK_VERSION': SK_VERSION,
+            'sizes': [len(d) for d in data],
+            'digests': [hashlib.sha256(d).hexdigest() for d in data],
+            'X': self.X, 'Y': self.Y, 'nn': self.nn,
+        }
+        with open(CACHE + '.tmp', 'wb') as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        # replace the old cache atomically
+        os.replace(CACHE + '.tmp', CACHE)
+
+    def rebuild(self):
+        '''Fit the model on all samples including the tail and update the cache'''
+        X = np.vstack([self.X, np.array(self.tail_X, dtype=np.uint16).reshape((-1, 8))])
+        Y = np.hstack([self.Y, self.tail_Y])
+        self.tail_X, self.tail_Y = [], []
+        self.train(X, Y)
+        data = []
+        for i in range(10):
+            with open('vals%d.dat' % i, 'rb') as f:
+                data.append(f.read())
+        self.save_cache(data)
 
     def train(self, X, Y):
         self.X = X
@@ -58,15 +127,26 @@ class NNClassifier(object):
         else:
             self.nn = None
 
+    def count(self, cls):
+        return (self.Y == cls).sum() + self.tail_Y.count(cls)
+
     def nearest(self, d):
-        dists = ((self.X - d)**2).sum(1)
+        X = np.vstack([self.X, np.array(self.tail_X, dtype=np.uint16).reshape((-1, 8))])
+        Y = np.hstack([self.Y, self.tail_Y])
+        dists = ((X.astype(np.int64) - d)**2).sum(1)
         ind = dists.argmin()
-        return self.Y[ind]
+        return Y[ind]
 
     def classify(self, d):
-        if self.X.shape[0] < K * SUBSAMPLE: return 0
-        if not HAVE_SK: return self.nearest(d)
-        return int(self.nn.predict(d)[0])
+        if self.X.shape[0] + len(self.tail_X) < K * SUBSAMPLE: return 0
+        if not HAVE_SK or self.nn is None: return self.nearest(d)
+        if not self.tail_X: return int(self.nn.predict([d])[0])
+        # merge the neighbors of the kd-tree with those of the tail and take a majority vote
+        dists, inds = self.nn.kneighbors([d])
+        tail_dists = np.sqrt(((np.array(self.tail_X) - d)**2).sum(1))
+        all_dists = np.concatenate([dists[0], tail_dists])
+        labels = np.concatenate([self.Y[::SUBSAMPLE][inds[0]], self.tail_Y]).astype(int)
+        return int(np.bincount(labels[np.argsort(all_dists)[:K]]).argmax())
 
 
 class Myo(MyoRaw):
@@ -146,7 +226,7 @@ def classify(m):
                 x = 0
                 y = 0 + 30 * i
                 clr = (0,200,0) if i == r else (255,255,255)
-                txt = font.render('%5d' % (m.cls.Y == i).sum(), True, (255,255,255))
+                txt = font.render('%5d' % m.cls.count(i), True, (255,255,255))
                 scr.blit(txt, (x + 20, y))
                 txt = font.render('%d' % i, True, clr)
                 scr.blit(txt, (x + 110, y))
@@ -0,0 +1,58 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import argparse
+import logging
+import time
+from myo_raw import MyoRaw, DataCategory, EMGMode
+from myo_raw.connection import PRESETS
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--tty', default=None, help='The Myo dongle device (autodetected if omitted)')
+parser.add_argument('--mac', default=None, help='The Myo MAC address (arbitrarily detected if omitted)')
+modes = ', '.join([str(item.value) + ': ' + item.name for item in EMGMode])
+parser.add_argument('--emg_mode', type=int, default=EMGMode.RAW, choices=[m.value for m in EMGMode],
+        help='Choose the EMG receiving mode ({0} - default: %(default)s)'.format(modes))
+parser.add_argument('--duration', type=float, default=10, help='Measurement duration per preset')
+parser.add_argument('-v', '--verbose', action='count', default=0, help='Increase verbosity')
+args = parser.parse_args()
+logging.basicConfig(level=max(2 - args.verbose, 0) * 10)
+
+# count the received samples of each data category
+counts = {category: 0 for category in DataCategory}
+def counter(category):
+    def count(*_):
+        counts[category] += 1
+    return count
+
+myo = MyoRaw(args.tty, False, args.mac)
+myo.add_handler(DataCategory.EMG, counter(DataCategory.EMG))
+myo.add_handler(DataCategory.IMU, counter(DataCategory.IMU))
+myo.subscribe(args.emg_mode)
+myo.set_sleep_mode(1)
+
+# measure the sample rates for each connection parameter preset on the live link
+try:
+    for name in PRESETS:
+        myo.set_connection_parameters(name)
+        # allow the armband to accept the new parameters before measuring
+        t_settle = time.time() + 1
+        while time.time() < t_settle:
+            myo.run(0.1)
+        for category in counts:
+            counts[category] = 0
+        t0 = time.time()
+        while time.time() < t0 + args.duration:
+            myo.run(0.1)
+        elapsed = time.time() - t0
+        print('{:15} {} - EMG: {:6.1f} Hz, IMU: {:5.1f} Hz'.format(
+            name, myo.backend.connection_parameters, counts[DataCategory.EMG] / elapsed,
+            counts[DataCategory.IMU] / elapsed))
+except KeyboardInterrupt:
+    pass
+finally:
+    myo.disconnect()
+    print('Disconnected')
@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import argparse
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--module', default='myo_raw', help='The module to be imported')
+parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to show')
+parser.add_argument('--runs', type=int, default=5, help='Number of measurements (best is shown)')
+args = parser.parse_args()
+
+# measure the import time in fresh interpreters as reported by python -X importtime
+best = None
+for _ in range(args.runs):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + args.module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    if best is None or imports[-1][0] < best[-1][0]:
+        best = imports
+
+print('import {}: {:.1f} ms'.format(args.module, best[-1][0] / 1000))
+for cumulative, name in sorted(best, reverse=True)[1:args.top + 1]:
+    print('{:10.1f} ms  {}'.format(cumulative / 1000, name))
+loaded = {name for _, name in best}
+for backend_module in ('serial', 'bluepy'):
+    if backend_module in loaded:
+        print('warning: {} is imported eagerly'.format(backend_module))
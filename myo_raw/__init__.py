@@ -9,20 +9,27 @@
 #
 
 import enum
+import importlib.util
 import struct
 import time
 import logging
-from .consumerpool import ConsumerPool
-from .bled112 import BLED112
-try:
-    from .native import Native
-except ImportError:
-    NATIVE_SUPPORT = False
-else:
-    NATIVE_SUPPORT = True
+from .consumerpool import ConsumerPool, DataFilter
+from .cache import DeviceCache
+from .connection import ConnectionParameters, get_parameters
+from .backends import register_backend, available_backends, get_backend
+from .hooks import HookPoint, Hooks
+
+# check for bluepy without importing it (backends are only imported when used)
+NATIVE_SUPPORT = importlib.util.find_spec('bluepy') is not None
 
 LOG = logging.getLogger(__name__)
 
+def __getattr__(name):
+    # keep the backend classes accessible as package attributes without importing them eagerly
+    if name in ('BLED112', 'Native'):
+        return get_backend(name.lower())
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
 class Arm(enum.Enum):
     UNKNOWN = 0
     RIGHT = 1
@@ -46,8 +53,14 @@ class Pose(enum.Enum):
 
 
 class DataCategory(enum.Enum):
-    '''Categories of data available from the Myo armband'''
-    ARM, BATTERY, EMG, IMU, POSE = range(5)
+    '''
+    Categories of data available from the Myo armband (GAP marks a recovered link loss, LINK holds
+    link quality samples, see MyoRaw.monitor_link, EMG_MODE announces EMG mode changes, see
+    MyoRaw.set_emg_mode, ONSET holds muscle activation onsets and offsets, see
+    myo_raw.onset.OnsetDetector, SPECTRUM holds spectral EMG features, see
+    myo_raw.spectral.SpectralAnalyzer)
+    '''
+    ARM, BATTERY, EMG, IMU, POSE, GAP, LINK, EMG_MODE, ONSET, SPECTRUM = range(10)
 
 
 class EMGMode(enum.IntEnum):
@@ -58,6 +71,16 @@ class EMGMode(enum.IntEnum):
     RAW = 0x03
 
 
+# sampling rates and notified characteristics (CCCD handles) of the EMG modes
+EMG_RATES = {EMGMode.OFF: 0, EMGMode.SMOOTHED: 50, EMGMode.RAW_FILTERED: 200, EMGMode.RAW: 200}
+_EMG_CCCDS = {
+    EMGMode.OFF: (),
+    EMGMode.SMOOTHED: (0x28,),
+    EMGMode.RAW_FILTERED: (0x2c, 0x2f, 0x32, 0x35),
+    EMGMode.RAW: (0x2c, 0x2f, 0x32, 0x35),
+}
+
+
 class IMUMode(enum.IntEnum):
     '''Modes of IMU data'''
     OFF = 0x00
@@ -77,30 +100,100 @@ class CLFState(enum.IntEnum):
 class MyoRaw():
     '''Implements the Myo-specific communication protocol.'''
 
-    def __init__(self, tty=None, native=False, mac=None):
+    def __init__(self, tty=None, native=False, mac=None, cache=None, scan_timeout=None,
+                 connect_timeout=5, reconnect=True, conn_params=None, backend=None,
+                 backend_options=None):
         '''
         Scan and connect to a Myo armband using either the BLED112 or a native Bluetooth adapter
 
         :param tty: the device name of a Bluegiga BLED112 adapter
         :param native: if true try to use a native Bluetooth adapter (Linux only)
         :param mac: the MAC address of the Myo (randomly chosen if None)
+        :param cache: a DeviceCache used to connect directly to a known Myo without scanning
+        :param scan_timeout: the maximum amount of time to scan for a Myo (infinite if None)
+        :param connect_timeout: the maximum amount of time to wait for a direct connection
+        :param reconnect: if true reconnect and restore the last state after a link loss
+        :param conn_params: the BLE connection parameters (a preset name: max_throughput, balanced or
+          low_power, or a ConnectionParameters instance), the backend default if None
+        :param backend: the name of a registered backend (overrides native, see available_backends)
+        :param backend_options: keyword arguments passed to the backend (defaults to the tty for the
+          BLED112 backend)
         '''
-        if native and not NATIVE_SUPPORT:
+        self._t_init = time.time()
+        self.time_to_first_sample = None
+        if backend is None:
+            backend = 'native' if native else 'bled112'
+        if backend_options is None:
+            backend_options = {'tty': tty} if backend == 'bled112' else {}
+        # a stub peripheral can be passed to the native backend without bluepy
+        if backend == 'native' and not NATIVE_SUPPORT and 'peripheral' not in backend_options:
             raise ImportError('bluepy is required to use a native Bluetooth adapter')
-        self.backend = Native() if native else BLED112(tty)
-        self.cpool = ConsumerPool(DataCategory)
+        self.backend = get_backend(backend)(**backend_options)
+        # hook points shared by the backend, the decoder and the consumer threads
+        self.hooks = Hooks()
+        self.backend.hooks = self.hooks
+        self.cpool = ConsumerPool(DataCategory, self.hooks)
+        self.cache = cache
+        self.subscription = None
+        self.connect_timeout = connect_timeout
+        self.conn_params = get_parameters(conn_params) if conn_params is not None else None
+        # state replayed after recovering from a link loss
+        self.reconnect = reconnect
+        self.outages = []
+        self._link_lost = None
+        self._recovery = None
+        self._recovery_deadline = None
+        self._lost_again = False
+        self._emg_mode_deferred = False
+        self._sleep_mode = None
+        self._leds = None
+        self.backend.disconnect_handler = self._on_link_lost
+        self._publishers = []
+        self._histories = {}
+        self._link_interval = None
+        self._link_pending = False
+        self._link_last = None
+
+        # connect directly to a known Myo armband and skip reading its attributes
+        profile = cache.get(mac) if cache is not None else None
+        if profile is not None and self._connect_cached(profile, connect_timeout):
+            self.mac = profile['mac']
+            self.version = tuple(profile['version'])
+            self.subscription = profile['subscription']
+            LOG.info('connected to %s (%s) using the device cache', profile['name'], self.mac)
+            LOG.debug('firmware version: %d.%d.%d.%d', *self.version)
+            return
 
         # scan and connect to a Myo armband and extract the firmware version
-        mac = self.backend.scan('4248124a7f2c4847b9de04a9010006d5', mac)
-        self.backend.connect(mac)
-        firmware = self.backend.read_attr(0x17)
+        self.mac = self.backend.scan('4248124a7f2c4847b9de04a9010006d5', mac, scan_timeout)
+        if self.mac is None:
+            raise TimeoutError('no Myo armband found within %s s' % scan_timeout)
+        self.backend.connect(self.mac, params=self.conn_params)
+        # read the firmware version, device name and battery level in a single batch
+        firmware, name, battery = self.backend.wait([
+            self.backend.submit_read_attr(0x17),
+            self.backend.submit_read_attr(0x03),
+            self.backend.submit_read_attr(0x11),
+        ])
         self.version = struct.unpack('<HHHH', firmware)
+        if cache is not None:
+            cache.update(self.mac, version=self.version, name=name.decode('utf-8'))
+            self.subscription = cache.get(self.mac)['subscription']
 
         # log device name, current battery level and firmware version
-        LOG.info('connected to %s (%s)', self.get_name(), mac)
-        LOG.info('battery level: %s %%', self.get_battery_level())
+        LOG.info('connected to %s (%s)', name.decode('utf-8'), self.mac)
+        LOG.info('battery level: %s %%', struct.unpack('<B', battery)[0])
         LOG.debug('firmware version: %d.%d.%d.%d', *self.version)
 
+    def _connect_cached(self, profile, timeout):
+        try:
+            self.backend.connect(profile['mac'], timeout, self.conn_params)
+        except Exception as err:
+            LOG.warning('direct connect to %s failed (%s), falling back to scanning',
+                        profile['mac'], err)
+            return False
+        return True
+
     def __enter__(self):
         return self
 
@@ -109,12 +202,147 @@ class MyoRaw():
 
     def run(self, timeout=None):
         '''
-        Block until a packet is received or until the given timeout has elapsed
+        Block until a packet is received or until the given timeout has elapsed. After a link loss
+        the reconnection attempts (if reconnect is enabled) progress in the background while
+        receiving.
 
         :params timeout: the maximum amount of time to wait for a packet
         '''
+        self._prepare_receive()
         self.backend.recv_packet(timeout)
 
+    def fileno(self):
+        '''
+        Return a file descriptor of the backend which becomes readable when data has been received
+        (to be used with select, poll or selectors in combination with pump)
+        '''
+        return self.backend.fileno()
+
+    def pump(self):
+        '''
+        Process all data received so far without blocking
+
+        :returns: the number of handled notifications
+        '''
+        self._prepare_receive()
+        return self.backend.pump()
+
+    def _prepare_receive(self):
+        if self._link_lost is not None and self.reconnect:
+            self._recover()
+        # the link is not sampled while it is lost (or being recovered)
+        if self._link_interval is not None and not self._link_pending and \
+                self._link_lost is None and time.time() >= self._link_last[0] + self._link_interval:
+            self._sample_link()
+        return True
+
+    def monitor_link(self, interval=1.0):
+        '''
+        Periodically sample the link quality while running (BLED112 only). The requests are
+        answered in between the notifications and passed to the handlers of DataCategory.LINK with
+        the timestamp, the RSSI in dBm, the connection interval (in 1.25 ms), the slave latency, the
+        supervision timeout (in 10 ms) and the notification rate since the previous sample. The
+        link is only sampled within run and pump, i.e. while data arrives in an event loop
+        selecting on fileno.
+
+        :param interval: the time between two samples in seconds (None to stop monitoring)
+        '''
+        self._link_interval = interval
+        self._link_last = (time.time(), self.backend.notifications)
+
+    def _sample_link(self):
+        self._link_pending = True
+        try:
+            rssi = self.backend.submit_rssi()
+            status = self.backend.submit_connection_status()
+        except NotImplementedError as err:
+            LOG.warning('link monitoring is not supported (%s)', err)
+            self._link_interval = None
+            return
+        def emit(_):
+            # the status event follows the RSSI response, hence both are resolved now
+            self._link_pending = False
+            if status.exception() is not None or not rssi.done() or rssi.exception() is not None:
+                return
+            cur_time, notifications = time.time(), self.backend.notifications
+            last_time, last_notifications = self._link_last
+            self._link_last = (cur_time, notifications)
+            rate = (notifications - last_notifications) / (cur_time - last_time)
+            params = status.result()
+            self._emit(DataCategory.LINK, cur_time, rssi.result(), params.max_interval,
+                       params.latency, params.timeout, rate)
+        status.add_done_callback(emit)
+
+    def _on_link_lost(self, reason):
+        # a pending link sample is never completed by the lost connection
+        self._link_pending = False
+        if self._link_lost is None:
+            self._link_lost = time.time()
+        elif self._recovery is not None:
+            self._lost_again = True
+
+    def _recover(self):
+        # start a connection attempt or cancel one exceeding the connect timeout (never blocks)
+        if self._recovery is None:
+            self._recovery_deadline = None if self.connect_timeout is None else \
+                time.time() + self.connect_timeout
+            self._recovery = self.backend.submit_connect(self.mac, self.conn_params)
+            self._recovery.add_done_callback(self._on_reconnected)
+        elif self._recovery_deadline is not None and time.time() > self._recovery_deadline:
+            self._recovery_deadline = None
+            self.backend.cancel_connect(self._recovery)
+
+    def _on_reconnected(self, connected):
+        '''Replay the subscription, sleep mode and LED state without waiting for the writes'''
+        if connected.exception() is not None:
+            LOG.warning('reconnecting to %s failed (%s)', self.mac, connected.exception())
+            self._recovery = None
+            return
+        writes = []
+        if self.subscription is not None:
+            writes.extend(self._subscription_writes(**self.subscription))
+        if self._sleep_mode is not None:
+            writes.append((0x19, struct.pack('<3B', 0x09, 1, self._sleep_mode)))
+        if self._leds is not None:
+            logo, line = self._leds
+            writes.append((0x19, struct.pack('<8B', 0x06, 6, *(logo + line))))
+        self._lost_again = False
+        try:
+            futures = [self.backend.submit_write_attr(attr, val) for attr, val in writes]
+        except Exception as err:
+            # e.g. the link was lost again, the next attempt is started while receiving
+            LOG.warning('replaying the state of %s failed (%s)', self.mac, err)
+            self._recovery = None
+            return
+        if futures:
+            # the writes are executed in order, hence all are done once the last one is
+            futures[-1].add_done_callback(lambda _: self._finish_recovery(futures))
+        else:
+            self._finish_recovery(futures)
+
+    def _finish_recovery(self, futures):
+        self._recovery = None
+        if self._lost_again:
+            LOG.warning('link to %s lost again while replaying its state', self.mac)
+            return
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            LOG.warning('replaying the state of %s failed (%s)', self.mac, errors[0])
+        cur_time = time.time()
+        outage = (self._link_lost, cur_time - self._link_lost)
+        self._link_lost = None
+        self.outages.append(outage)
+        if self._link_interval is not None:
+            # the notification rate of the next link sample excludes the outage
+            self._link_last = (cur_time, self.backend.notifications)
+        LOG.warning('reconnected to %s after an outage of %.3f s', self.mac, outage[1])
+        self._emit(DataCategory.GAP, *outage)
+        if self._emg_mode_deferred and not errors:
+            # announce an EMG mode set while the link was lost
+            self._emg_mode_deferred = False
+            emg_mode = EMGMode(self.subscription['emg_mode'])
+            self._emit(DataCategory.EMG_MODE, cur_time, emg_mode, EMG_RATES[emg_mode])
+
     def subscribe(self, emg_mode=EMGMode.RAW, imu_mode=IMUMode.ON, clf_state=CLFState.ACTIVE, battery=True):
         '''
         Subscribe to chosen data channels. Note that the parameters have no influcence when using a
@@ -142,20 +370,36 @@ class MyoRaw():
           :2: activate the on-board classifier but disable the indication (sync gesture is enabled)
 
         :param battery: whether to enable battery notifications or not
+
+        The arguments are stored in the subscription attribute (and the device cache if any) to
+        allow resubscribing with ``myo.subscribe(**myo.subscription)``.
         '''
+        # queue all writes at once and wait for their completion (executed in order)
+        writes = self._subscription_writes(emg_mode, imu_mode, clf_state, battery)
+        self.backend.wait([self.backend.submit_write_attr(attr, val) for attr, val in writes])
+        self.subscription = {'emg_mode': int(emg_mode), 'imu_mode': int(imu_mode),
+                             'clf_state': int(clf_state), 'battery': battery}
+        if self.cache is not None:
+            self.cache.update(self.mac, subscription=self.subscription)
 
+        # set the right data handling function for the chosen backend
+        self.backend.handler = self._handle_data
+
+    def _subscription_writes(self, emg_mode, imu_mode, clf_state, battery):
+        # return the attribute writes of a subscription as (attr, value) tuples
+        writes = []
         if self.version < (1, 0, 0, 0):
             # don't know what these do; Myo Connect sends them, though we get data fine without them
-            self.backend.write_attr(0x19, b'\x01\x02\x00\x00')
+            writes.append((0x19, b'\x01\x02\x00\x00'))
             # subscribe to notifications of the four official EMG characteristics
-            self.backend.write_attr(0x2f, b'\x01\x00')
-            self.backend.write_attr(0x2c, b'\x01\x00')
-            self.backend.write_attr(0x32, b'\x01\x00')
-            self.backend.write_attr(0x35, b'\x01\x00')
+            writes.append((0x2f, b'\x01\x00'))
+            writes.append((0x2c, b'\x01\x00'))
+            writes.append((0x32, b'\x01\x00'))
+            writes.append((0x35, b'\x01\x00'))
             # subscribe to notifications of the "hidden" EMG characteristics
-            self.backend.write_attr(0x28, b'\x01\x00')
+            writes.append((0x28, b'\x01\x00'))
             # subscribe to notifications of the IMU characteristic
-            self.backend.write_attr(0x1d, b'\x01\x00')
+            writes.append((0x1d, b'\x01\x00'))
 
             # Sampling rate of the underlying EMG sensor, capped to 1000. If it's less than 1000,
             # emg_hz is correct. If it is greater, the actual framerate starts dropping inversely.
@@ -168,28 +412,28 @@ class MyoRaw():
             imu_hz = 50
             # send sensor parameters, or we don't get any data
             data = struct.pack('<4BH5B', 2, 9, 2, 1, f_s, emg_smooth, f_s // emg_hz, imu_hz, 0, 0)
-            self.backend.write_attr(0x19, data)
+            writes.append((0x19, data))
         else:
             # subscribe to notifications of the IMU characteristic
             if imu_mode != IMUMode.OFF:
-                self.backend.write_attr(0x1d, b'\x01\x00')
+                writes.append((0x1d, b'\x01\x00'))
             # subscribe to indications of the classifier (arm on/off, pose, etc.) characteristic
             if clf_state == CLFState.ACTIVE:
-                self.backend.write_attr(0x24, b'\x02\x00')
+                writes.append((0x24, b'\x02\x00'))
             # subscribe to notifications of the battery characteristic
             if battery:
-                self.backend.write_attr(0x12, b'\x01\x10')
+                writes.append((0x12, b'\x01\x10'))
             # subscribe to notifications of the EMG characteristic(s)
             if emg_mode in [EMGMode.RAW, EMGMode.RAW_FILTERED]:
                 # subscribe to notifications of the four official EMG characteristics
-                self.backend.write_attr(0x2c, b'\x01\x00')  # Suscribe to EmgData0Characteristic
-                self.backend.write_attr(0x2f, b'\x01\x00')  # Suscribe to EmgData1Characteristic
-                self.backend.write_attr(0x32, b'\x01\x00')  # Suscribe to EmgData2Characteristic
-                self.backend.write_attr(0x35, b'\x01\x00')  # Suscribe to EmgData3Characteristic
+                writes.append((0x2c, b'\x01\x00'))  # Suscribe to EmgData0Characteristic
+                writes.append((0x2f, b'\x01\x00'))  # Suscribe to EmgData1Characteristic
+                writes.append((0x32, b'\x01\x00'))  # Suscribe to EmgData2Characteristic
+                writes.append((0x35, b'\x01\x00'))  # Suscribe to EmgData3Characteristic
             elif emg_mode == EMGMode.SMOOTHED:
                 # subscribe to notifications of the "hidden" (not listed in the myohw_services enum
                 # of the official BLE specification from Thalmic Labs) EMG characteristic
-                self.backend.write_attr(0x28, b'\x01\x00')
+                writes.append((0x28, b'\x01\x00'))
 
             # Activate EMG, IMU and classifier notifications. Note that sending a 0x01 for the EMG
             # mode (not listed on the myohw_emg_mode_t struct of the Myo BLE specification) will
@@ -200,62 +444,138 @@ class MyoRaw():
             # not as useful as a truly raw signal).
             # command breakdown: set EMG and IMU, payload size = 3, EMG, IMU and classifier modes
             clf_mode = clf_state != CLFState.OFF
-            self.backend.write_attr(0x19, b'\x01\x03' + bytes([emg_mode, imu_mode, clf_mode]))
-
-        # add data handlers
-        def handle_data(attr, pay):
-            cur_time = time.time()
-            if attr == 0x27:
-                # Unpack a 17 byte array, first 16 are 8 unsigned shorts, last one an unsigned char
-                # not entirely sure what the last byte is, but it's a bitmask that seems to indicate
-                # which sensors think they're being moved around or something
-                emg = struct.unpack('<8H', pay[:16])
-                moving = pay[16]
-                self.cpool.enqueue_data(DataCategory.EMG, cur_time, emg, moving, None)
-            # Read notification handles corresponding to the for EMG characteristics
-            elif attr in (0x2b, 0x2e, 0x31, 0x34):
-                # According to http://developerblog.myo.com/myocraft-emg-in-the-bluetooth-protocol/
-                # each characteristic sends two sequential readings in each update, so the received
-                # payload is split in two samples. According to the Myo BLE specification, the data
-                # type of the EMG samples is int8_t.
-                emg1 = struct.unpack('<8b', pay[:8])
-                emg2 = struct.unpack('<8b', pay[8:])
-                characteristic_num = int((attr - 1) / 3 - 14)
-                self.cpool.enqueue_data(DataCategory.EMG, cur_time, emg1, None, characteristic_num)
-                self.cpool.enqueue_data(DataCategory.EMG, cur_time, emg2, None, characteristic_num)
-            # Read IMU characteristic handle
-            elif attr == 0x1c:
-                quat = struct.unpack('<4h', pay[:8])
-                acc = struct.unpack('<3h', pay[8:14])
-                gyro = struct.unpack('<3h', pay[14:20])
-                self.cpool.enqueue_data(DataCategory.IMU, cur_time, quat, acc, gyro)
-            # Read classifier characteristic handle
-            elif attr == 0x23:
-                # note that older Myo versions send three bytes whereas newer ones send six bytes
-                typ, val, xdir = struct.unpack('<3B', pay[:3])
-                if typ == 1:  # on arm
-                    self.cpool.enqueue_data(DataCategory.ARM, cur_time, Arm(val), XDirection(xdir))
-                elif typ == 2:  # removed from arm
-                    self.cpool.enqueue_data(DataCategory.ARM, cur_time, Arm.UNKNOWN, XDirection.UNKNOWN)
-                elif typ == 3:  # pose
-                    self.cpool.enqueue_data(DataCategory.POSE, cur_time, Pose(val))
-            # Read battery characteristic handle
-            elif attr == 0x11:
-                battery_level = ord(pay)
-                self.cpool.enqueue_data(DataCategory.BATTERY, cur_time, battery_level)
-            else:
-                LOG.warning('data with unknown attr: %02X %s', attr, pay)
+            writes.append((0x19, b'\x01\x03' + bytes([emg_mode, imu_mode, clf_mode])))
+        return writes
 
-        # set the right data handling function for the chosen backend
-        self.backend.handler = handle_data
+    def set_emg_mode(self, emg_mode, wait=True):
+        '''
+        Switch the EMG mode of the current subscription (firmware v1.0 or higher). The handlers
+        of DataCategory.EMG_MODE are called with the timestamp, the new mode and its sampling rate
+        once the Myo has accepted the new mode.
+
+        :param emg_mode: the new EMGMode
+        :param wait: if false only queue the commands, which is required when called from an inline
+          handler (the commands are then executed in between the notifications)
+        :returns: the futures of the queued commands (none while the link is lost, the new mode is
+          then applied and announced once the state is replayed after reconnecting)
+        '''
+        if self.subscription is None or self.version < (1, 0, 0, 0):
+            raise RuntimeError('set_emg_mode requires an active subscription and firmware v1.0')
+        emg_mode = EMGMode(emg_mode)
+        if self._link_lost is not None and (self._recovery is None or not self._recovery.done()):
+            # the state is not replayed yet, so it replays the new mode
+            self.subscription['emg_mode'] = int(emg_mode)
+            if self.cache is not None:
+                self.cache.update(self.mac, subscription=self.subscription)
+            self._emg_mode_deferred = True
+            return []
+        old_mode = EMGMode(self.subscription['emg_mode'])
+        old_cccds, new_cccds = _EMG_CCCDS[old_mode], _EMG_CCCDS[emg_mode]
+        writes = [(attr, b'\x00\x00') for attr in old_cccds if attr not in new_cccds]
+        writes.extend((attr, b'\x01\x00') for attr in new_cccds if attr not in old_cccds)
+        imu_mode = self.subscription['imu_mode']
+        clf_mode = self.subscription['clf_state'] != CLFState.OFF
+        writes.append((0x19, b'\x01\x03' + bytes([emg_mode, imu_mode, clf_mode])))
+        futures = [self.backend.submit_write_attr(attr, val) for attr, val in writes]
+        self.subscription['emg_mode'] = int(emg_mode)
+        if self.cache is not None:
+            self.cache.update(self.mac, subscription=self.subscription)
+
+        def announce(future):
+            if future.exception() is None:
+                self._emit(DataCategory.EMG_MODE, time.time(), emg_mode, EMG_RATES[emg_mode])
+        futures[-1].add_done_callback(announce)
+        if wait:
+            self.backend.wait(futures)
+        return futures
+
+    def _handle_data(self, notifications):
+        # notifications are (attr, payload, arrival time) tuples
+        if self.time_to_first_sample is None:
+            self.time_to_first_sample = notifications[0][2] - self._t_init
+            LOG.info('time to first sample: %.3f s', self.time_to_first_sample)
+        hooks = self.hooks
+        for attr, pay, cur_time in notifications:
+            self._decode(cur_time, attr, pay)
+            if hooks.notification_decoded:
+                for hook in hooks.notification_decoded:
+                    hook(cur_time, attr, pay)
+
+    def _emit(self, category, *data):
+        # pass a decoded sample on to the history and the handlers of its data category
+        history = self._histories.get(category)
+        if history is not None:
+            history.append(*data)
+        self.cpool.enqueue_data(category, *data)
+        if self.hooks.sample_enqueued:
+            for hook in self.hooks.sample_enqueued:
+                hook(category, data)
+
+    def _decode(self, cur_time, attr, pay):
+        if attr == 0x27:
+            # Unpack a 17 byte array, first 16 are 8 unsigned shorts, last one an unsigned char
+            # not entirely sure what the last byte is, but it's a bitmask that seems to indicate
+            # which sensors think they're being moved around or something
+            emg = struct.unpack('<8H', pay[:16])
+            moving = pay[16]
+            self._emit(DataCategory.EMG, cur_time, emg, moving, None)
+        # Read notification handles corresponding to the for EMG characteristics
+        elif attr in (0x2b, 0x2e, 0x31, 0x34):
+            # According to http://developerblog.myo.com/myocraft-emg-in-the-bluetooth-protocol/
+            # each characteristic sends two sequential readings in each update, so the received
+            # payload is split in two samples. According to the Myo BLE specification, the data
+            # type of the EMG samples is int8_t.
+            emg1 = struct.unpack('<8b', pay[:8])
+            emg2 = struct.unpack('<8b', pay[8:])
+            characteristic_num = int((attr - 1) / 3 - 14)
+            self._emit(DataCategory.EMG, cur_time, emg1, None, characteristic_num)
+            self._emit(DataCategory.EMG, cur_time, emg2, None, characteristic_num)
+        # Read IMU characteristic handle
+        elif attr == 0x1c:
+            quat = struct.unpack('<4h', pay[:8])
+            acc = struct.unpack('<3h', pay[8:14])
+            gyro = struct.unpack('<3h', pay[14:20])
+            self._emit(DataCategory.IMU, cur_time, quat, acc, gyro)
+        # Read classifier characteristic handle
+        elif attr == 0x23:
+            # note that older Myo versions send three bytes whereas newer ones send six bytes
+            typ, val, xdir = struct.unpack('<3B', pay[:3])
+            if typ == 1:  # on arm
+                self._emit(DataCategory.ARM, cur_time, Arm(val), XDirection(xdir))
+            elif typ == 2:  # removed from arm
+                self._emit(DataCategory.ARM, cur_time, Arm.UNKNOWN, XDirection.UNKNOWN)
+            elif typ == 3:  # pose
+                self._emit(DataCategory.POSE, cur_time, Pose(val))
+        # Read battery characteristic handle
+        elif attr == 0x11:
+            battery_level = ord(pay)
+            self._emit(DataCategory.BATTERY, cur_time, battery_level)
+        else:
+            LOG.warning('data with unknown attr: %02X %s', attr, pay)
 
     def disconnect(self):
         '''
         Disconnect from the Myo armband
         '''
         self.backend.handler = None
+        self.backend.disconnect_handler = None
+        if self._recovery is not None:
+            self.backend.cancel_connect(self._recovery)
         self.cpool.shutdown()
         self.backend.disconnect()
+        self.backend.close()
+        for writer in self._publishers:
+            writer.close()
+        self._publishers.clear()
+
+    def set_connection_parameters(self, params):
+        '''
+        Request new BLE connection parameters on the live link (also used when reconnecting)
+
+        :param params: a preset name (max_throughput, balanced or low_power) or ConnectionParameters
+        '''
+        self.conn_params = get_parameters(params)
+        self.backend.update_connection(self.conn_params)
 
     def set_sleep_mode(self, mode):
         '''
@@ -264,6 +584,7 @@ class MyoRaw():
         :params mode: the sleep mode - 0: sleep after a period of inactiviy, 1: disable sleep
         '''
         assert mode in [0, 1], 'mode must be 0 or 1'
+        self._sleep_mode = mode
         self.backend.write_attr(0x19, struct.pack('<3B', 0x09, 1, mode))
 
     def deep_sleep(self):
@@ -289,6 +610,7 @@ class MyoRaw():
         :params logo: the RGB (iterable of integers from 0 to 255) logo color value
         :params line: the RGB (iterable of integers from 0 to 255) line color value
         '''
+        self._leds = (logo, line)
         self.backend.write_attr(0x19, struct.pack('<8B', 0x06, 6, *(logo + line)))
 
     def get_battery_level(self):
@@ -315,14 +637,91 @@ class MyoRaw():
         '''
         return self.backend.read_attr(0x03).decode('utf-8')
 
-    def add_handler(self, data_category, handler):
+    def add_handler(self, data_category, handler, decimation=1, channels=None, predicate=None,
+                    inline=False, budget=None):
         '''
         Add a handler to process data of a specific category
 
         :param data_category: data category of the handler function
         :param handler: function to be called
+        :param decimation: only pass every n-th sample (accepted by the predicate) to the handler
+        :param channels: the indices of the EMG channels passed to the handler (all if None)
+        :param predicate: function called with the handler arguments of each sample, samples are
+          dropped if it returns False
+        :param inline: if true call the handler synchronously in the receive path right after
+          decoding instead of in its own thread (it must return quickly as it delays reception)
+        :param budget: the time in seconds an inline handler call may take, overruns are logged and
+          counted (see inline_handler_stats) like the exceptions raised by an inline handler
+        '''
+        data_filter = None
+        if decimation != 1 or channels is not None or predicate is not None:
+            transform = None
+            if channels is not None:
+                if data_category != DataCategory.EMG:
+                    raise ValueError('channels can only be selected for EMG data')
+                channels = tuple(channels)
+                transform = lambda data: (data[0], tuple(data[1][i] for i in channels)) + data[2:]
+            data_filter = DataFilter(decimation, predicate, transform)
+        self.cpool.add_callback(data_category, handler, data_filter, inline, budget)
+
+    def inline_handler_stats(self):
+        '''
+        Return the call statistics of all inline handlers
+
+        :returns: a list of dicts with the data category, handler, budget, number of calls,
+          number of budget overruns, the number of raised exceptions and the maximum call duration
+        '''
+        return [{'category': consumer.data_category, 'handler': consumer.callback,
+                 'budget': consumer.budget, 'calls': consumer.calls,
+                 'overruns': consumer.overruns, 'errors': consumer.errors,
+                 'max_duration': consumer.max_duration}
+                for consumer in self.cpool.inline_consumers()]
+
+    def track_history(self, data_category, seconds=10, rate=200):
+        '''
+        Keep a rolling history of the samples of a data category (requires NumPy)
+
+        :param data_category: the data category to be tracked
+        :param seconds: the duration of the history at the given rate
+        :param rate: the expected maximum sample rate of the data category
+        '''
+        from .history import RollingHistory
+        self._histories[data_category] = RollingHistory(data_category, int(seconds * rate))
+
+    def history(self, data_category, seconds=None, count=None):
+        '''
+        Return the most recent samples of a tracked data category as a structured array view
+        without copying (see myo_raw.records for the dtypes)
+
+        :param data_category: the data category (tracked with track_history)
+        :param seconds: only return the samples of the last seconds (all if None)
+        :param count: only return the last count samples (all if None)
+        :returns: a NumPy structured array view of the samples (oldest first)
+        '''
+        history = self._histories[data_category]
+        if seconds is not None:
+            return history.seconds(seconds)[-count if count else None:]
+        return history.last(count)
+
+    def publish(self, data_categories=None, slots=4096, prefix=None):
+        '''
+        Publish data into shared memory ring buffers to be consumed by other local processes with
+        myo_raw.sharedmem.SharedStreamReader (removed on disconnecting)
+
+        :param data_categories: the data categories to be published (all if None)
+        :param slots: the number of records kept in each ring buffer
+        :param prefix: the shared memory names are prefix_category (chosen by the system if None)
+        :returns: a dict mapping the data categories to the names of their shared memory blocks
         '''
-        self.cpool.add_callback(data_category, handler)
+        from .sharedmem import SharedStreamWriter
+        names = {}
+        for category in data_categories or DataCategory:
+            name = None if prefix is None else '%s_%s' % (prefix, category.name.lower())
+            writer = SharedStreamWriter(category, name, slots)
+            self._publishers.append(writer)
+            self.add_handler(category, writer.write)
+            names[category] = writer.name
+        return names
 
     def pop_handler(self, data_category, index=-1):
         '''
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Switch between a low and a high rate EMG mode depending on the muscle activity'''
+
+import logging
+from . import DataCategory, EMGMode, EMG_RATES
+
+LOG = logging.getLogger(__name__)
+
+class AdaptiveEMGController():
+    '''
+    Watch the EMG envelope and switch to the high rate mode on activity and back to the low rate
+    mode after a period of rest (with hysteresis). The envelope is the exponential moving average
+    of the mean absolute value over all channels. As the smoothed and the raw modes differ in scale,
+    each mode has its own threshold.
+    '''
+
+    def __init__(self, myo, low_mode=EMGMode.SMOOTHED, high_mode=EMGMode.RAW, rise_threshold=200,
+                 fall_threshold=4, time_constant=0.1, hold=2.0, settle=0.2):
+        '''
+        :param myo: the subscribed MyoRaw instance (firmware v1.0 or higher)
+        :param low_mode: the EMG mode used at rest
+        :param high_mode: the EMG mode used during activity
+        :param rise_threshold: switch to the high mode once the envelope exceeds this value (in the
+          units of the low mode)
+        :param fall_threshold: switch to the low mode once the envelope stays below this value (in
+          the units of the high mode) for the hold time
+        :param time_constant: the time constant of the envelope in seconds
+        :param hold: the time in seconds the envelope has to stay below the fall threshold
+        :param settle: the time in seconds samples are ignored after switching the mode
+        '''
+        self.myo = myo
+        self.low_mode = EMGMode(low_mode)
+        self.high_mode = EMGMode(high_mode)
+        self.rise_threshold = rise_threshold
+        self.fall_threshold = fall_threshold
+        self.time_constant = time_constant
+        self.hold = hold
+        self.settle = settle
+        self.switches = 0
+        self.mode = EMGMode(myo.subscription['emg_mode'])
+        self.envelope = 0.0
+        self._alpha = 0.0
+        self._ignore_until = None
+        self._below_since = None
+        self._enter(self.mode, None)
+
+    def attach(self):
+        '''Register the controller as inline EMG handler of its MyoRaw instance'''
+        self.myo.add_handler(DataCategory.EMG, self, inline=True)
+
+    def _enter(self, mode, timestamp):
+        self.mode = mode
+        # weight of a new sample in the envelope at the sampling rate of the mode
+        rate = EMG_RATES[mode] or 1
+        self._alpha = min(1.0, 1.0 / (rate * self.time_constant))
+        self.envelope = 0.0
+        self._below_since = None
+        self._ignore_until = None if timestamp is None else timestamp + self.settle
+
+    def _switch(self, mode, timestamp):
+        LOG.info('switching EMG mode from %s to %s (envelope %.1f)', self.mode.name, mode.name,
+                 self.envelope)
+        self.switches += 1
+        self._enter(mode, timestamp)
+        # queue the commands without waiting as the controller runs in the receive path (while the
+        # link is lost the new mode is applied on reconnecting)
+        self.myo.set_emg_mode(mode, wait=False)
+
+    def __call__(self, timestamp, emg, moving, characteristic_num):
+        '''Inline handler of EMG samples'''
+        if self._ignore_until is not None:
+            if timestamp < self._ignore_until:
+                return
+            self._ignore_until = None
+        value = sum(abs(channel) for channel in emg) / len(emg)
+        self.envelope += self._alpha * (value - self.envelope)
+        if self.mode == self.low_mode:
+            if self.envelope > self.rise_threshold:
+                self._switch(self.high_mode, timestamp)
+        elif self.envelope < self.fall_threshold:
+            if self._below_since is None:
+                self._below_since = timestamp
+            elif timestamp - self._below_since >= self.hold:
+                self._switch(self.low_mode, timestamp)
+        else:
+            self._below_since = None
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import importlib
+import logging
+
+LOG = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'myo_raw.backends'
+
+# backends are registered as 'module:attribute' strings to import them only when used
+_REGISTRY = {
+    'bled112': 'myo_raw.bled112:BLED112',
+    'native': 'myo_raw.native:Native',
+    'stream': 'myo_raw.streaming:StreamBackend',
+}
+_entry_points_loaded = False
+
+def register_backend(name, factory):
+    '''
+    Register a Bluetooth backend
+
+    :param name: the name used to select the backend
+    :param factory: the backend class (or any callable returning a backend) or a
+      'module:attribute' string to import it lazily
+    '''
+    _REGISTRY[name] = factory
+
+def _load_entry_points():
+    '''Register third-party backends advertised in the myo_raw.backends entry point group'''
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib import metadata
+    except ImportError:
+        return
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+    for entry_point in entry_points:
+        _REGISTRY.setdefault(entry_point.name, entry_point.value)
+
+def available_backends():
+    '''
+    Return the names of all registered backends (without importing them)
+
+    :returns: a sorted list of backend names
+    '''
+    _load_entry_points()
+    return sorted(_REGISTRY)
+
+def get_backend(name):
+    '''
+    Import (if necessary) and return the factory of a registered backend
+
+    :param name: the name of the backend
+    :returns: the backend class or factory
+    '''
+    if name not in _REGISTRY:
+        _load_entry_points()
+    try:
+        factory = _REGISTRY[name]
+    except KeyError:
+        raise ValueError('unknown backend %r (available: %s)' %
+                         (name, ', '.join(available_backends()))) from None
+    if isinstance(factory, str):
+        module_name, _, attribute = factory.partition(':')
+        factory = getattr(importlib.import_module(module_name), attribute)
+        _REGISTRY[name] = factory
+        LOG.debug('loaded backend %s from %s', name, module_name)
+    return factory
@@ -0,0 +1,225 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Compute windowed EMG features of recorded sessions in parallel across CPU cores'''
+
+import argparse
+import concurrent.futures
+import itertools
+import logging
+import os
+import time
+import numpy as np
+from .recording import CODECS, RecordingReader, RecordingWriter
+
+LOG = logging.getLogger(__name__)
+
+# features of each window: mean absolute value, root mean square, waveform length and the number of
+# zero crossings per channel, stamped with the time of the last sample of the window
+FEATURE_DTYPE = np.dtype([('timestamp', '<f8'), ('mav', '<f4', (8,)), ('rms', '<f4', (8,)),
+                          ('wl', '<f4', (8,)), ('zc', '<u2', (8,))])
+
+class Featurizer():
+    '''Compute the features of sliding windows over EMG samples fed in consecutive blocks.'''
+
+    def __init__(self, window, step, first=0, min_end=0, zc_threshold=0):
+        '''
+        :param window: the number of samples per window
+        :param step: the number of samples between the starts of two windows
+        :param first: the position (in the whole recording) of the first sample fed
+        :param min_end: only windows ending after this position are computed (to skip the windows
+          of the preceding work unit)
+        :param zc_threshold: the minimum amplitude step counted as zero crossing
+        '''
+        self.window = window
+        self.step = step
+        self.zc_threshold = zc_threshold
+        # windows are aligned to the whole recording: window k covers [k * step, k * step + window)
+        self._next = max(0, (min_end - window) // step + 1)
+        self._first = first
+        self._times = np.empty(0)
+        self._emg = np.empty((0, 8), np.float32)
+
+    def feed(self, timestamps, emg):
+        '''
+        Add a block of samples and return the features of all windows completed by it
+
+        :param timestamps: the timestamps of the samples
+        :param emg: the EMG values of the samples with shape (n, 8)
+        :returns: a structured array (FEATURE_DTYPE)
+        '''
+        times = np.concatenate([self._times, timestamps])
+        values = np.concatenate([self._emg, np.asarray(emg, np.float32)])
+        last = (self._first + len(times) - self.window) // self.step
+        starts = np.arange(self._next, last + 1) * self.step - self._first
+        features = self._compute(times, values, starts)
+        self._next = max(self._next, last + 1)
+        # keep the samples needed by the next windows
+        keep = max(min(self._next * self.step - self._first, len(times)), 0)
+        self._times, self._emg = times[keep:], values[keep:]
+        self._first += keep
+        return features
+
+    def _compute(self, times, values, starts):
+        features = np.zeros(len(starts), FEATURE_DTYPE)
+        if not len(starts):
+            return features
+        windows = values[starts[:, np.newaxis] + np.arange(self.window)]  # (n, window, 8)
+        features['timestamp'] = times[starts + self.window - 1]
+        features['mav'] = np.abs(windows).mean(axis=1)
+        features['rms'] = np.sqrt((windows ** 2).mean(axis=1))
+        diff = np.diff(windows, axis=1)
+        features['wl'] = np.abs(diff).sum(axis=1)
+        crossings = (windows[:, :-1] * windows[:, 1:] < 0) & (np.abs(diff) >= self.zc_threshold)
+        features['zc'] = crossings.sum(axis=1)
+        return features
+
+
+def _read_csv(path, block_size):
+    # stream the rows of an EMG CSV file of examples/myo-record.py in blocks
+    with open(path) as csv_file:
+        header = csv_file.readline().strip().split(',')
+        if header[1:9] != ['emg%d' % i for i in range(1, 9)]:
+            raise ValueError('%s is not an EMG CSV file' % path)
+        while True:
+            lines = list(itertools.islice(csv_file, block_size))
+            if not lines:
+                return
+            rows = np.loadtxt(lines, delimiter=',', usecols=range(9), ndmin=2)
+            yield rows[:, 0], rows[:, 1:9]
+
+def _read_recording(path, stream, start, stop, block_size):
+    with RecordingReader(path) as reader:
+        if stop is None:
+            for array in reader.chunks(stream):
+                yield array['timestamp'], array['emg']
+            return
+        for position in range(start, stop, block_size):
+            array = reader.read_slice(stream, position, min(position + block_size, stop))
+            yield array['timestamp'], array['emg']
+
+def process_unit(path, window, step, start=0, stop=None, zc_threshold=0, stream='emg',
+                 block_size=65536):
+    '''
+    Compute the features of a recording or of a range of its samples (run in a worker process)
+
+    :param path: a recording (.myorec) or an EMG CSV file
+    :param window: the number of samples per window
+    :param step: the number of samples between the starts of two windows
+    :param start: the position of the first window end handled by this unit (recordings only)
+    :param stop: the position after the last sample handled by this unit (the end if None)
+    :param zc_threshold: the minimum amplitude step counted as zero crossing
+    :param stream: the name of the EMG stream of a recording
+    :param block_size: the number of samples processed at once
+    :returns: the features, the number of processed samples and the consumed CPU time
+    '''
+    cpu_start = time.process_time()
+    # read the preceding samples needed by the windows ending in this unit (overlap)
+    first = max(start - window, 0)
+    featurizer = Featurizer(window, step, first, start, zc_threshold)
+    if path.endswith('.csv'):
+        blocks = _read_csv(path, block_size)
+    else:
+        blocks = _read_recording(path, stream, first, stop, block_size)
+    results, samples = [], 0
+    for timestamps, emg in blocks:
+        results.append(featurizer.feed(timestamps, emg))
+        samples += len(timestamps)
+    samples -= start - first
+    return np.concatenate(results or [np.empty(0, FEATURE_DTYPE)]), samples, \
+        time.process_time() - cpu_start
+
+def _units(path, chunk_samples, stream):
+    # split large recordings into ranges of samples, process anything else as a whole
+    if chunk_samples is None or path.endswith('.csv'):
+        return [(0, None)]
+    with RecordingReader(path) as reader:
+        count = reader.count(stream)
+    return [(start, min(start + chunk_samples, count)) for start in range(0, count, chunk_samples)]
+
+def output_path(path, outdir):
+    '''Return the path of the features of a recording'''
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(outdir, name + '_features.myorec')
+
+def process(paths, outdir, window=200, step=50, workers=None, chunk_samples=None, zc_threshold=0,
+            compression='zlib', stream='emg'):
+    '''
+    Compute the features of all recordings in a process pool and write them into recordings
+
+    :param paths: recordings (.myorec) or EMG CSV files
+    :param outdir: the directory of the feature recordings (stream features)
+    :param window: the number of samples per window
+    :param step: the number of samples between the starts of two windows
+    :param workers: the number of worker processes (the number of CPUs if None)
+    :param chunk_samples: split recordings into units of this many samples processed in parallel
+      (whole files if None)
+    :param zc_threshold: the minimum amplitude step counted as zero crossing
+    :param compression: the compression of the feature recordings
+    :param stream: the name of the EMG stream of the recordings
+    :returns: a dict with the number of samples, the wall and CPU time and the throughput
+    '''
+    workers = workers or os.cpu_count()
+    os.makedirs(outdir, exist_ok=True)
+    started = time.time()
+    samples, cpu_time = 0, 0.0
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        jobs = []
+        for path in paths:
+            futures = [executor.submit(process_unit, path, window, step, start, stop,
+                                       zc_threshold, stream)
+                       for start, stop in _units(path, chunk_samples, stream)]
+            jobs.append((path, futures))
+        for path, futures in jobs:
+            # the units of a file are written in order as they complete
+            with RecordingWriter(output_path(path, outdir), compression) as writer:
+                for future in futures:
+                    features, unit_samples, unit_cpu_time = future.result()
+                    if len(features):
+                        writer.append('features', features)
+                    samples += unit_samples
+                    cpu_time += unit_cpu_time
+            LOG.info('processed %s', path)
+    elapsed = time.time() - started
+    return {
+        'files': len(paths),
+        'samples': samples,
+        'elapsed': elapsed,
+        'cpu_time': cpu_time,
+        'workers': workers,
+        'samples_per_second': samples / elapsed if elapsed else 0.0,
+        'samples_per_second_per_core': samples / cpu_time if cpu_time else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help='Recordings (.myorec) or EMG CSV files')
+    parser.add_argument('-o', '--outdir', default='.', help='Directory of the feature recordings')
+    parser.add_argument('--window', type=int, default=200,
+                        help='Samples per window (default: %(default)s)')
+    parser.add_argument('--step', type=int, default=50,
+                        help='Samples between window starts (default: %(default)s)')
+    parser.add_argument('--zc-threshold', type=float, default=0,
+                        help='Minimum amplitude step of a zero crossing (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-samples', type=int, default=None,
+                        help='Split recordings into units of this many samples (default: per file)')
+    parser.add_argument('--compression', default='zlib', choices=sorted(CODECS),
+                        help='Compression codec (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+    logging.basicConfig(level=max(2 - args.verbose, 0) * 10)
+
+    report = process(args.paths, args.outdir, args.window, args.step, args.workers,
+                     args.chunk_samples, args.zc_threshold, args.compression)
+    print('{} files, {} samples in {:.1f} s with {} workers'.format(
+        report['files'], report['samples'], report['elapsed'], report['workers']))
+    print('{:.0f} samples/s, {:.0f} samples/s per core'.format(
+        report['samples_per_second'], report['samples_per_second_per_core']))
+
+if __name__ == '__main__':
+    main()
@@ -7,16 +7,33 @@
 # Licensed under the MIT license. See the LICENSE file for details.
 #
 
+import collections
 import struct
 import threading
 import time
 import re
 import logging
+import socket
+from concurrent.futures import Future
 import serial
 from serial.tools import list_ports
+from .connection import ConnectionParameters, MAX_THROUGHPUT
+from .hooks import Hooks
 
 LOG = logging.getLogger(__name__)
 
+class BLED112Error(Exception):
+    '''Error code reported by the BLED112 in response to a specific command or procedure'''
+
+    def __init__(self, description, code=None):
+        if code is None:
+            super().__init__('%s failed without a response' % description)
+        else:
+            super().__init__('%s failed with error code 0x%04X' % (description, code))
+        self.description = description
+        self.code = code
+
+
 class Packet():
     '''BLED112 packet representation'''
 
@@ -32,63 +49,253 @@ class Packet():
              ' '.join('%02X' % b for b in list(self.payload)))
 
 
+class Procedure():
+    '''An attribute procedure (read or write) queued for execution on the current connection'''
+
+    def __init__(self, description, cmd, payload, completion):
+        '''
+        :param description: human-readable description used to attribute errors
+        :param cmd: the attclient command of the procedure
+        :param payload: the payload of the attclient command
+        :param completion: the attclient event completing the procedure (None if the command
+        response is sufficient)
+        '''
+        self.description = description
+        self.cmd = cmd
+        self.payload = payload
+        self.completion = completion
+        self.future = Future()
+
+
+class RingBuffer():
+    '''A preallocated byte ring buffer filled by a single producer and drained by one consumer'''
+
+    def __init__(self, size):
+        self._buf = bytearray(size)
+        self._size = size
+        # monotonic read and write positions (the buffer index is the position modulo the size)
+        self._read = 0
+        self._write = 0
+        self._cond = threading.Condition()
+        self.high_water = 0
+        self.dropped = 0
+        # the error which stopped the producer (raised to the consumer once the buffer is drained)
+        self.error = None
+
+    def __len__(self):
+        return self._write - self._read
+
+    def put(self, data):
+        '''Append data (dropped completely if there is not enough free space)'''
+        with self._cond:
+            level = self._write - self._read
+            if level + len(data) > self._size:
+                self.dropped += len(data)
+                return False
+            start = self._write % self._size
+            end = start + len(data)
+            if end <= self._size:
+                self._buf[start:end] = data
+            else:
+                split = self._size - start
+                self._buf[start:] = data[:split]
+                self._buf[:end - self._size] = data[split:]
+            self._write += len(data)
+            self.high_water = max(self.high_water, level + len(data))
+            self._cond.notify()
+        return True
+
+    def peek(self, size):
+        '''Return the next size bytes without consuming them'''
+        start = self._read % self._size
+        end = start + size
+        if end <= self._size:
+            return bytes(self._buf[start:end])
+        return bytes(self._buf[start:]) + bytes(self._buf[:end - self._size])
+
+    def consume(self, size):
+        '''Discard the next size bytes'''
+        with self._cond:
+            self._read += size
+
+    def get(self, size):
+        '''Return and consume the next size bytes'''
+        data = self.peek(size)
+        self.consume(size)
+        return data
+
+    def fail(self, error):
+        '''Stop the consumer from waiting for data which will never arrive'''
+        with self._cond:
+            self.error = error
+            self._cond.notify_all()
+
+    def wait(self, size, timeout=None):
+        '''Wait until at least size bytes are available or the timeout has elapsed'''
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._write - self._read >= size or self.error is not None, timeout)
+
+
 class BLED112():
     '''Non-Myo-specific Bluetooth backend using the provided BLED112 dongle with pyserial.'''
 
-    def __init__(self, tty):
+    def __init__(self, tty, buffer_size=1 << 20):
         if tty is None:
             tty = self._detect_tty()
         if tty is None:
             raise ValueError('Bluegiga BLED112 dongle not found!')
         self.conn = None
-        self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1)
-        self.buf = []
+        self.connection_parameters = None
+        self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1, timeout=0.1)
         self.lock = threading.Lock()
-        self._internal_handler = None
+        self.parse_errors = 0
+        self.notifications = 0
+        # a dedicated thread moves raw bytes from the serial port into the receive buffer
+        self._rx = RingBuffer(buffer_size)
+        self._rx_needed = 1
+        # the reader thread signals new data through a socket pair to support select and epoll
+        self._signal_recv, self._signal_send = socket.socketpair()
+        self._signal_recv.setblocking(False)
+        self._signalled = False
+        self._reading = True
+        self._reader = threading.Thread(target=self._read_serial, name='BLED112 reader', daemon=True)
+        self._reader.start()
         self._external_handler = None
+        self.disconnect_handler = None
+        self.hooks = Hooks()
+        # correlation tables of outstanding commands, events and attribute procedures
+        self._responses = collections.deque()
+        # outstanding status requests in order, the first _status_answered ones were answered by
+        # the dongle and are resolved by the following status events of the connection
+        self._status_requests = collections.deque()
+        self._status_answered = 0
+        # the future of a connection attempt, resolved by its first connected status event
+        self._pending_connect = None
+        self._procedures = collections.deque()
+        self._active_procedure = None
+
+        # stop scanning and terminate previous connection 0, 1 and 2
+        self._send_command(6, 4)
+        for connection_number in range(3):
+            self._send_command(3, 0, struct.pack('<B', connection_number))
 
     @staticmethod
     def _detect_tty():
         '''Try to find a Bluegiga BLED112 dongle'''
-        for port, desc, hwid in list_ports.comports():
-            if re.search(r'PID=2458:0*1', hwid):
-                LOG.debug('using "%s" at port %s', desc, port)
-                return port
+        ttys = detect_ttys()
+        if ttys:
+            LOG.debug('using the BLED112 at port %s', ttys[0])
+            return ttys[0]
         return None
 
+    @property
+    def buffer_level(self):
+        '''The number of received bytes not yet parsed'''
+        return len(self._rx)
+
+    @property
+    def buffer_high_water(self):
+        '''The maximum number of received bytes not yet parsed since opening the dongle'''
+        return self._rx.high_water
+
+    @property
+    def buffer_dropped(self):
+        '''The number of bytes dropped due to a full receive buffer'''
+        return self._rx.dropped
+
+    def _read_serial(self):
+        # keep the ingestion loop minimal to never fall behind the USB CDC buffer
+        ser, rx = self.ser, self._rx
+        while self._reading:
+            try:
+                data = ser.read(ser.in_waiting or 1)
+            except serial.SerialException as err:
+                LOG.error('reading from the BLED112 failed: %s', err)
+                # wake up any waiting caller (and select) to raise the error
+                rx.fail(err)
+                self._signal_send.send(b'\x00')
+                return
+            if data and not rx.put(data):
+                LOG.warning('receive buffer full, dropped %d bytes', len(data))
+            elif data and not self._signalled:
+                self._signalled = True
+                self._signal_send.send(b'\x00')
+
+    def close(self):
+        '''Stop the reader thread and close the serial port'''
+        self._reading = False
+        self._reader.join()
+        self.ser.close()
+        self._signal_recv.close()
+        self._signal_send.close()
+
+    def fileno(self):
+        '''Return a file descriptor which becomes readable when data has been received'''
+        return self._signal_recv.fileno()
+
+    def pump(self):
+        '''
+        Process all complete packets received so far without blocking
+
+        :returns: the number of handled notifications
+        '''
+        # clear the signal before processing to not miss data arriving in the meantime
+        self._signalled = False
+        try:
+            while self._signal_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        notifications = self.notifications
+        while self._process_packet() is not None:
+            pass
+        if self._rx.error is not None:
+            raise self._rx.error
+        return self.notifications - notifications
+
     # internal data-handling methods
     def recv_packet(self, timeout=None):
         t0 = time.time()
-        self.ser.timeout = None
-        while timeout is None or time.time() < t0 + timeout:
-            if timeout is not None:
-                self.ser.timeout = t0 + timeout - time.time()
-            c = self.ser.read()
-            if not c:
+        while True:
+            packet = self._process_packet()
+            if packet is not None:
+                return packet
+            if self._rx.error is not None:
+                raise self._rx.error
+            remaining = None if timeout is None else t0 + timeout - time.time()
+            if remaining is not None and remaining <= 0:
                 return None
+            self._rx.wait(self._rx_needed, remaining)
 
-            ret = self._proc_byte(ord(c))
-            if ret:
-                if ret.typ == 0x80:
-                    self._handle_event(ret)
-                return ret
-
-    def _proc_byte(self, c):
-        if not self.buf:
-            if c in [0x00, 0x80, 0x08, 0x88]:  # [BLE response pkt, BLE event pkt, wifi response pkt, wifi event pkt]
-                self.buf.append(c)
-            return None
-        elif len(self.buf) == 1:
-            self.buf.append(c)
-            self.packet_len = 4 + (self.buf[0] & 0x07) + self.buf[1]
-            return None
-        else:
-            self.buf.append(c)
+    def _process_packet(self):
+        packet = self._parse_packet()
+        if packet is not None:
+            if self.hooks.frame_received:
+                for hook in self.hooks.frame_received:
+                    hook(packet)
+            if packet.typ == 0x00:
+                self._handle_response(packet)
+            elif packet.typ == 0x80:
+                self._handle_event(packet)
+        return packet
 
-        if self.packet_len and len(self.buf) == self.packet_len:
-            p = Packet(self.buf)
-            self.buf = []
-            return p
+    def _parse_packet(self):
+        rx = self._rx
+        while len(rx) >= 2:
+            header = rx.peek(2)
+            # [BLE response pkt, BLE event pkt, wifi response pkt, wifi event pkt]
+            if header[0] not in (0x00, 0x80, 0x08, 0x88):
+                rx.consume(1)
+                self.parse_errors += 1
+                continue
+            packet_len = 4 + ((header[0] & 0x07) << 8) + header[1]
+            if len(rx) < packet_len:
+                self._rx_needed = packet_len
+                return None
+            self._rx_needed = 2
+            return Packet(rx.get(packet_len))
+        self._rx_needed = 2
         return None
 
     @property
@@ -101,41 +308,166 @@ class BLED112():
         def wrapped_handle_data(packet):
             if (packet.cls, packet.cmd) != (4, 5):
                 return
-            _, attr, _ = struct.unpack('<BHB', packet.payload[:4])
+            _, attr, typ = struct.unpack('<BHB', packet.payload[:4])
+            if typ in (0, 3, 4):
+                # responses to read procedures are no notifications
+                return
             pay = packet.payload[5:]
-            func(attr, pay)
+            self.notifications += 1
+            func([(attr, pay, time.time())])
         self._external_handler = wrapped_handle_data if callable(func) else None
 
+    def _handle_response(self, p):
+        # BGAPI answers commands strictly in the order they were sent
+        for index, (cls, cmd, _) in enumerate(self._responses):
+            if (p.cls, p.cmd) == (cls, cmd):
+                break
+        else:
+            LOG.warning('dropped unexpected response: %s', p)
+            return
+        # resynchronize: the responses of all commands sent before the matching one were lost
+        for _ in range(index):
+            cls, cmd, future = self._responses.popleft()
+            LOG.warning('no response to command (%02X, %02X) before %s', cls, cmd, p)
+            future.set_exception(BLED112Error('command (%02X, %02X)' % (cls, cmd)))
+        self._responses.popleft()[2].set_result(p)
+
     def _handle_event(self, p):
-        if self._internal_handler:
-            self._internal_handler(p)
+        if p.cls == 4 and self._active_procedure is not None:
+            self._handle_procedure_event(p)
+        elif (p.cls, p.cmd) == (3, 0):
+            self._handle_connection_status(p)
+        elif (p.cls, p.cmd) == (3, 4):
+            self._handle_disconnected(p)
         if self._external_handler:
             self._external_handler(p)
 
-    def _wait_event(self, cls, cmd):
-        res = [None]
+    @staticmethod
+    def _parse_connection_status(p):
+        # connection status event: connection, flags, address, address type, interval, timeout,
+        # latency, bonding
+        conn, _, _, _, interval, timeout, latency, _ = struct.unpack('<BB6sBHHHB', p.payload[:16])
+        return conn, ConnectionParameters(interval, interval, latency, timeout)
 
-        def h(p):
-            if p.cls == cls and p.cmd == cmd:
-                res[0] = p
-        self._internal_handler = h
-        while res[0] is None:
-            self.recv_packet()
-        self._internal_handler = None
-        return res[0]
+    def _handle_connection_status(self, p):
+        conn, params = self._parse_connection_status(p)
+        if conn == self.conn:
+            self.connection_parameters = params
+            LOG.debug('connection parameters: %s', self.connection_parameters)
+            # self.conn is only set by the connect response, so status events of earlier requests
+            # never complete a connection attempt
+            connected = self._pending_connect
+            if connected is not None and p.payload[1] & 0x01:
+                self._pending_connect = None
+                connected.set_result(p)
+            elif self._status_answered:
+                # status events of a lost link are dropped above as self.conn is None
+                self._status_answered -= 1
+                self._status_requests.popleft().set_result(p)
 
-    # specific BLE commands
-    def scan(self, target_uuid, target_address=None):
-        # stop scanning and terminate previous connection 0, 1 and 2
-        self._send_command(6, 4)
-        for connection_number in range(3):
-            self._send_command(3, 0, struct.pack('<B', connection_number))
+    def _handle_disconnected(self, p):
+        # disconnected event: connection, reason
+        conn, reason = struct.unpack('<BH', p.payload[:3])
+        if conn != self.conn:
+            return
+        LOG.warning('connection %d lost (reason 0x%04X)', conn, reason)
+        self.conn = None
+        # report the loss before failing the outstanding procedures to let their callbacks know
+        if self.disconnect_handler:
+            self.disconnect_handler(reason)
+        # fail all outstanding attribute procedures of the lost connection
+        procedures = [self._active_procedure] if self._active_procedure else []
+        procedures.extend(self._procedures)
+        self._active_procedure = None
+        self._procedures.clear()
+        for proc in procedures:
+            proc.future.set_exception(BLED112Error(proc.description, reason))
+        # fail pending status requests as the next status event belongs to a new connection
+        requests = list(self._status_requests)
+        self._status_requests.clear()
+        self._status_answered = 0
+        for request in requests:
+            request.set_exception(BLED112Error('connection status request', reason))
+
+    def _handle_procedure_event(self, p):
+        proc = self._active_procedure
+        if p.cmd == 1:
+            # procedure completed event: connection, result, characteristic handle
+            _, result, _ = struct.unpack('<BHH', p.payload[:5])
+            if result:
+                self._finish_procedure(exception=BLED112Error(proc.description, result))
+            elif proc.completion == (4, 1):
+                self._finish_procedure()
+        elif p.cmd == 5 and proc.completion == (4, 5):
+            # attribute value event: only a read response (type 0) completes a read procedure
+            _, attr, typ = struct.unpack('<BHB', p.payload[:4])
+            if typ == 0 and attr == struct.unpack('<H', proc.payload[1:3])[0]:
+                # strip off the 4 byte L2CAP header and the payload length byte
+                self._finish_procedure(p.payload[5:])
+
+    def _on_procedure_response(self, proc, response):
+        if proc is not self._active_procedure:
+            # the procedure has already been failed (e.g. due to a lost connection)
+            return
+        if response.exception() is not None:
+            self._finish_procedure(exception=BLED112Error(proc.description))
+            return
+        _, result = struct.unpack('<BH', response.result().payload[:3])
+        if result:
+            self._finish_procedure(exception=BLED112Error(proc.description, result))
+        elif proc.completion is None:
+            self._finish_procedure()
+
+    def _finish_procedure(self, result=None, exception=None):
+        proc, self._active_procedure = self._active_procedure, None
+        if exception is None:
+            proc.future.set_result(result)
+        else:
+            proc.future.set_exception(exception)
+        self._start_next_procedure()
+
+    def _start_next_procedure(self):
+        if self._active_procedure is None and self._procedures:
+            proc = self._active_procedure = self._procedures.popleft()
+            response = self._write_command(4, proc.cmd, proc.payload)
+            response.add_done_callback(lambda response: self._on_procedure_response(proc, response))
+
+    def _submit_procedure(self, description, cmd, payload, completion):
+        proc = Procedure(description, cmd, payload, completion)
+        self._procedures.append(proc)
+        self._start_next_procedure()
+        return proc.future
+
+    def wait(self, futures, timeout=None):
+        '''
+        Process incoming packets until all given futures are resolved
+
+        :param futures: futures returned by submit_read_attr and submit_write_attr
+        :param timeout: the maximum amount of time to wait for all futures
+        :returns: the list of results (raises the error of the first failed future)
+        '''
+        t0 = time.time()
+        for future in futures:
+            while not future.done():
+                remaining = None if timeout is None else t0 + timeout - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('BLED112 did not respond within %s s' % timeout)
+                self.recv_packet(remaining)
+        return [future.result() for future in futures]
 
+    # specific BLE commands
+    def scan(self, target_uuid, target_address=None, timeout=None):
         # start scanning
         LOG.info('scanning for devices...')
         self._send_command(6, 2, b'\x01')
+        t0 = time.time()
         while True:
-            packet = self.recv_packet()
+            remaining = None if timeout is None else t0 + timeout - time.time()
+            packet = self.recv_packet(remaining) if remaining is None or remaining > 0 else None
+            if packet is None:
+                # stop scanning after the timeout has elapsed
+                self._send_command(6, 4)
+                return None
             if packet.payload.endswith(bytes.fromhex(target_uuid)):
                 address = list(list(packet.payload[2:8]))
                 address_string = ':'.join(format(item, '02x') for item in reversed(address))
@@ -145,42 +477,169 @@ class BLED112():
                     self._send_command(6, 4)
                     return address_string
 
-    def connect(self, target_address):
+    def connect(self, target_address, timeout=None, params=None):
+        connected = self.submit_connect(target_address, params)
+        try:
+            self.wait([connected], timeout)
+        except TimeoutError:
+            self.cancel_connect(connected)
+            raise
+
+    def submit_connect(self, target_address, params=None):
+        '''
+        Start a direct connection without waiting for it to be established
+
+        :param target_address: the MAC address of the remote device
+        :param params: the requested ConnectionParameters (MAX_THROUGHPUT if None)
+        :returns: a future resolved by the connection status event once connected
+        '''
+        params = MAX_THROUGHPUT if params is None else params
         address = [int(item, 16) for item in reversed(target_address.split(':'))]
-        conn_pkt = self._send_command(6, 3, struct.pack('<6sBHHHH', bytes(address), 0, 6, 6, 64, 0))
-        self.conn = list(conn_pkt.payload)[-1]
-        self._wait_event(3, 0)
+        connected = Future()
+        self._pending_connect = connected
+        def on_response(response):
+            if self._pending_connect is not connected:
+                # cancelled before the response arrived
+                return
+            # connect direct response: result, connection handle
+            if response.exception() is None:
+                result, conn = struct.unpack('<HB', response.result().payload[:3])
+                if not result:
+                    self.conn = conn
+                    return
+                error = BLED112Error('connection to %s' % target_address, result)
+            else:
+                error = response.exception()
+            self._pending_connect = None
+            connected.set_exception(error)
+        self._write_command(6, 3, struct.pack('<6sBHHHH', bytes(address), 0, params.min_interval,
+                                              params.max_interval, params.timeout,
+                                              params.latency)).add_done_callback(on_response)
+        return connected
+
+    def cancel_connect(self, connected):
+        '''
+        Cancel a pending connection attempt without waiting for the response
+
+        :param connected: the future returned by submit_connect
+        '''
+        if self._pending_connect is connected:
+            self._pending_connect = None
+            self._write_command(6, 4)
+            self.conn = None
+            connected.set_exception(TimeoutError('connection attempt cancelled'))
+
+    def update_connection(self, params):
+        '''
+        Request new connection parameters on the live link (applied once the remote device
+        accepts them, see connection_parameters)
+
+        :param params: the requested ConnectionParameters
+        '''
+        if self.conn is not None:
+            response = self._send_command(3, 2, struct.pack('<BHHHH', self.conn, params.min_interval,
+                                                            params.max_interval, params.latency,
+                                                            params.timeout))
+            _, result = struct.unpack('<BH', response.payload[:3])
+            if result:
+                raise BLED112Error('connection update', result)
+
+    def submit_rssi(self):
+        '''
+        Request the RSSI of the connection without waiting for the result
+
+        :returns: a future resolved with the RSSI in dBm
+        '''
+        return _chain(self._write_command(3, 1, struct.pack('<B', self.conn)),
+                      lambda response: struct.unpack('<Bb', response.payload[:2])[1])
+
+    def submit_connection_status(self):
+        '''
+        Request the status of the connection without waiting for the result
+
+        :returns: a future resolved with the current ConnectionParameters of the link
+        '''
+        status = Future()
+        def on_response(response):
+            if status.done():
+                # failed by the loss of the link, the status event (if any) is dropped
+                return
+            if response.exception() is not None:
+                self._status_requests.remove(status)
+                status.set_exception(response.exception())
+            else:
+                self._status_answered += 1
+        payload = struct.pack('<B', self.conn)
+        self._status_requests.append(status)
+        self._write_command(3, 7, payload).add_done_callback(on_response)
+        return _chain(status, lambda event: self._parse_connection_status(event)[1])
 
     def disconnect(self):
         if self.conn is not None:
             return self._send_command(3, 0, struct.pack('<B', self.conn))
         return None
 
+    def submit_read_attr(self, attr):
+        '''
+        Queue reading an attribute without waiting for the result
+
+        :param attr: the attribute handle
+        :returns: a future resolved with the attribute value
+        '''
+        return self._submit_procedure('read of attribute 0x%02X' % attr, 4,
+                                      struct.pack('<BH', self.conn, attr), (4, 5))
+
+    def submit_write_attr(self, attr, val, wait_response=True):
+        '''
+        Queue writing an attribute without waiting for the result
+
+        :param attr: the attribute handle
+        :param val: the value to be written
+        :param wait_response: if true the future is resolved by the write response of the remote
+        device, otherwise by the acknowledgement of the BLED112
+        :returns: a future resolved on completion of the write
+        '''
+        return self._submit_procedure('write of attribute 0x%02X' % attr, 5,
+                                      struct.pack('<BHB', self.conn, attr, len(val)) + val,
+                                      (4, 1) if wait_response else None)
+
     def read_attr(self, attr):
         if self.conn is not None:
-            self._send_command(4, 4, struct.pack('<BH', self.conn, attr))
-            ble_payload = self._wait_event(4, 5).payload
-            # strip off the 4 byte L2CAP header and the payload length byte of the ble payload field
-            return ble_payload[5:]
+            return self.wait([self.submit_read_attr(attr)])[0]
         return None
 
     def write_attr(self, attr, val, wait_response=True):
         if self.conn is not None:
-            self._send_command(4, 5, struct.pack('<BHB', self.conn, attr, len(val)) + val)
-            if wait_response:
-                ble_payload = self._wait_event(4, 1).payload
-                # strip off the 4 byte L2CAP header and the payload length byte of the ble payload field
-                return ble_payload[5:]
+            return self.wait([self.submit_write_attr(attr, val, wait_response)])[0]
         return None
 
+    def _write_command(self, cls, cmd, payload=b''):
+        '''Send a command and return a future resolved by the corresponding response packet'''
+        future = Future()
+        self._responses.append((cls, cmd, future))
+        self.ser.write(struct.pack('<4B', 0, len(payload), cls, cmd) + payload)
+        return future
+
     def _send_command(self, cls, cmd, payload=b''):
-        s = struct.pack('<4B', 0, len(payload), cls, cmd) + payload
-        self.ser.write(s)
+        return self.wait([self._write_command(cls, cmd, payload)])[0]
 
-        while True:
-            p = self.recv_packet()
-            # no timeout, so p won't be None
-            if p.typ == 0:
-                return p
-            # not a response: must be an event
-            self._handle_event(p)
+
+def detect_ttys():
+    '''Return the device names of all connected Bluegiga BLED112 dongles (sorted)'''
+    ttys = []
+    for port, desc, hwid in list_ports.comports():
+        if re.search(r'PID=2458:0*1', hwid):
+            LOG.debug('found "%s" at port %s', desc, port)
+            ttys.append(port)
+    return sorted(ttys)
+
+def _chain(future, func):
+    '''Return a future resolved with the result of func applied to the result of future'''
+    chained = Future()
+    def resolve(done):
+        try:
+            chained.set_result(func(done.result()))
+        except Exception as err:
+            chained.set_exception(err)
+    future.add_done_callback(resolve)
+    return chained
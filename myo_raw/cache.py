@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import json
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+def default_cache_path():
+    '''Return the default location of the device cache (respecting XDG_CACHE_HOME)'''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'myo_raw', 'devices.json')
+
+
+class DeviceCache():
+    '''A persistent cache of Myo armband profiles used to connect without scanning.'''
+
+    def __init__(self, path=None):
+        '''
+        Load the cached profiles (a missing or corrupt cache file results in an empty cache).
+
+        :param path: the location of the JSON cache file (the default location if None)
+        '''
+        self.path = os.fspath(path) if path is not None else default_cache_path()
+        try:
+            with open(self.path) as cache_file:
+                self._profiles = json.load(cache_file)
+        except (OSError, ValueError):
+            self._profiles = {}
+        # armbands of a MyoGroup are connected in parallel threads
+        self._lock = threading.Lock()
+
+    def get(self, mac=None):
+        '''
+        Return the profile of a Myo armband
+
+        :param mac: the MAC address of the Myo (the most recently used one if None)
+        :returns: a dict with the keys mac, version, name, subscription and last_used or None
+        '''
+        if mac is not None:
+            return self._profiles.get(mac.lower())
+        if not self._profiles:
+            return None
+        return max(self._profiles.values(), key=lambda profile: profile['last_used'])
+
+    def update(self, mac, **fields):
+        '''
+        Update (or create) the profile of a Myo armband and store the cache
+
+        :param mac: the MAC address of the Myo
+        :param fields: profile fields to be updated (version, name or subscription)
+        '''
+        with self._lock:
+            profile = self._profiles.setdefault(mac.lower(), {'mac': mac.lower(),
+                                                              'subscription': None})
+            profile.update(fields, last_used=time.time())
+            self._store()
+
+    def remove(self, mac):
+        '''
+        Remove the profile of a Myo armband (e.g. after a failed direct connect)
+
+        :param mac: the MAC address of the Myo
+        '''
+        with self._lock:
+            if self._profiles.pop(mac.lower(), None) is not None:
+                self._store()
+
+    def _store(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(self._profiles, cache_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            LOG.warning('unable to store the device cache %s: %s', self.path, err)
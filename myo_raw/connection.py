@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import collections
+
+class ConnectionParameters(collections.namedtuple('ConnectionParameters',
+                                                  ['min_interval', 'max_interval', 'latency',
+                                                   'timeout'])):
+    '''
+    BLE connection parameters
+
+    :param min_interval: minimum connection interval in units of 1.25 ms (6 to 3200)
+    :param max_interval: maximum connection interval in units of 1.25 ms (6 to 3200)
+    :param latency: slave latency in connection events (0 to 499)
+    :param timeout: supervision timeout in units of 10 ms (10 to 3200)
+    '''
+    __slots__ = ()
+
+    def validate(self):
+        '''Raise a ValueError if the parameters violate the Bluetooth specification'''
+        if not 6 <= self.min_interval <= self.max_interval <= 3200:
+            raise ValueError('connection intervals must satisfy 6 <= min <= max <= 3200')
+        if not 0 <= self.latency <= 499:
+            raise ValueError('slave latency must be between 0 and 499')
+        if not 10 <= self.timeout <= 3200:
+            raise ValueError('supervision timeout must be between 10 and 3200')
+        # the supervision timeout must exceed twice the effective connection interval
+        if self.timeout * 10 <= (1 + self.latency) * self.max_interval * 1.25 * 2:
+            raise ValueError('supervision timeout too short for the interval and latency')
+        return self
+
+    @property
+    def max_events_per_second(self):
+        '''The number of connection events per second at the minimum connection interval'''
+        return 1000 / (self.min_interval * 1.25)
+
+
+# 7.5 ms interval: required for the 200 Hz raw EMG streams (about 150 notifications per second)
+MAX_THROUGHPUT = ConnectionParameters(6, 6, 0, 64)
+# 15 - 30 ms interval: sufficient for smoothed EMG and IMU data
+BALANCED = ConnectionParameters(12, 24, 0, 200)
+# 50 - 100 ms interval and skipping up to 4 idle connection events: battery and classifier data
+LOW_POWER = ConnectionParameters(40, 80, 4, 400)
+
+PRESETS = {
+    'max_throughput': MAX_THROUGHPUT,
+    'balanced': BALANCED,
+    'low_power': LOW_POWER,
+}
+
+def get_parameters(params):
+    '''
+    Return validated connection parameters
+
+    :param params: a preset name (max_throughput, balanced or low_power), a ConnectionParameters
+    instance or a tuple of (min_interval, max_interval, latency, timeout)
+    :returns: the corresponding ConnectionParameters
+    '''
+    if isinstance(params, str):
+        try:
+            return PRESETS[params]
+        except KeyError:
+            raise ValueError('unknown connection parameter preset: %s' % params) from None
+    return ConnectionParameters(*params).validate()
@@ -4,37 +4,143 @@
 # Licensed under the MIT license. See the LICENSE file for details.
 #
 
+import logging
 import queue
 import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+class DataFilter():
+    '''Drop, decimate or transform data before it is enqueued for a callback.'''
+
+    def __init__(self, decimation=1, predicate=None, transform=None):
+        '''
+        :param decimation: only pass on every n-th accepted data item
+        :param predicate: function called with the data, items are dropped if it returns False
+        :param transform: function mapping the data tuple to the tuple passed to the callback
+        '''
+        if decimation < 1:
+            raise ValueError('decimation must be a positive integer')
+        self.decimation = decimation
+        self.predicate = predicate
+        self.transform = transform
+        self._skipped = decimation - 1
+
+    def __call__(self, data):
+        '''Return the data to be enqueued or None if it is filtered out'''
+        if self.predicate is not None and not self.predicate(*data):
+            return None
+        if self._skipped < self.decimation - 1:
+            self._skipped += 1
+            return None
+        self._skipped = 0
+        return data if self.transform is None else self.transform(data)
+
+class InlineConsumer():
+    '''Stand-in for a consumer queue calling its callback directly in the enqueueing thread.'''
+
+    def __init__(self, data_category, callback, budget, pool):
+        '''
+        :param data_category: data category of the callback
+        :param callback: the callback function
+        :param budget: the time in seconds a single call may take (unchecked if None)
+        :param pool: the ConsumerPool owning the consumer
+        '''
+        self.data_category = data_category
+        self.callback = callback
+        self.budget = budget
+        self.calls = 0
+        self.overruns = 0
+        self.errors = 0
+        self.max_duration = 0.0
+        self._pool = pool
+
+    def put(self, data):
+        if data is self._pool._sentinel:
+            return
+        hooks = self._pool.hooks.callback_done if self._pool.hooks is not None else None
+        start = time.perf_counter()
+        thread_start = time.thread_time() if hooks else None
+        try:
+            self.callback(*data)
+        except Exception as err:
+            # an exception must not abort the receive path calling the inline handler
+            self.errors += 1
+            # report the first error and every hundredth after that
+            if self.errors % 100 == 1:
+                LOG.warning('inline %s handler %r raised %r (%d errors in %d calls)',
+                            self.data_category.name, self.callback, err, self.errors,
+                            self.calls + 1, exc_info=self.errors == 1)
+        duration = time.perf_counter() - start
+        self.calls += 1
+        if duration > self.max_duration:
+            self.max_duration = duration
+        if self.budget is not None and duration > self.budget:
+            self.overruns += 1
+            # report the first overrun and every hundredth after that
+            if self.overruns % 100 == 1:
+                LOG.warning('inline %s handler %r exceeded its budget of %.3f ms (%.3f ms, %d '
+                            'overruns in %d calls)', self.data_category.name, self.callback,
+                            self.budget * 1e3, duration * 1e3, self.overruns, self.calls)
+        if hooks:
+            elapsed = time.thread_time() - thread_start
+            for hook in hooks:
+                hook(self.data_category, self.callback, elapsed, data)
 
 class ConsumerPool():
     '''A pool of independent consumer threads.'''
-    def __init__(self, data_categories):
+    def __init__(self, data_categories, hooks=None):
         '''
         Create a pool of threads waiting for data to be consumed by their registered callbacks.
 
         :param data_categories: an iterable of all possible data categories to distinguish callbacks
         with different function signatures.
+        :param hooks: Hooks whose callback_done hooks are called with the data category, the
+        callback, its consumed CPU time and the data after every call
         '''
+        self.hooks = hooks
         self._queues = {category: [] for category in data_categories}
         self._callbacks = {category: [] for category in data_categories}
+        self._filters = {category: [] for category in data_categories}
         self._threads = {category: [] for category in data_categories}
         self._sentinel = object()
 
-    def add_callback(self, data_category, consumer_callback):
+    def add_callback(self, data_category, consumer_callback, data_filter=None, inline=False,
+                     budget=None):
         '''Add a data category specific callback to be called on data category specific data.
 
         :param data_category: data category of the callback
         :param consumer_callback: the callback function
+        :param data_filter: a function (e.g. a DataFilter) applied to the data tuple before it is
+        enqueued, returning the tuple to be enqueued or None to drop it
+        :param inline: if true call the callback directly in the thread enqueueing the data instead
+        of a consumer thread
+        :param budget: the time in seconds a single inline call may take before an overrun is
+        reported (see inline_consumers)
         '''
         self._callbacks[data_category].append(consumer_callback)
+        self._filters[data_category].append(data_filter)
+        if inline:
+            self._queues[data_category].append(InlineConsumer(data_category, consumer_callback,
+                                                              budget, self))
+            self._threads[data_category].append(None)
+            return
         data_queue = queue.SimpleQueue()
         self._queues[data_category].append(data_queue)
 
         def run_consumer():
             data = data_queue.get()
             while data is not self._sentinel:
-                consumer_callback(*data)
+                hooks = self.hooks.callback_done if self.hooks is not None else None
+                if hooks:
+                    start = time.thread_time()
+                    consumer_callback(*data)
+                    elapsed = time.thread_time() - start
+                    for hook in hooks:
+                        hook(data_category, consumer_callback, elapsed, data)
+                else:
+                    consumer_callback(*data)
                 data = data_queue.get()
 
         thread = threading.Thread(target=run_consumer)
@@ -49,7 +155,10 @@ class ConsumerPool():
         :param returns: the removed callback function
         '''
         self._queues[data_category].pop(index).put(self._sentinel)
-        self._threads[data_category].pop(index).join()
+        thread = self._threads[data_category].pop(index)
+        if thread is not None:
+            thread.join()
+        self._filters[data_category].pop(index)
         return self._callbacks[data_category].pop(index)
 
     def clear_callbacks(self, data_category):
@@ -60,19 +169,41 @@ class ConsumerPool():
         for data_queue in self._queues[data_category]:
             data_queue.put(self._sentinel)
         for thread in self._threads[data_category]:
-            thread.join()
+            if thread is not None:
+                thread.join()
         self._queues[data_category].clear()
         self._callbacks[data_category].clear()
+        self._filters[data_category].clear()
         self._threads[data_category].clear()
 
+    def inline_consumers(self, data_category=None):
+        '''Return the InlineConsumers (with their call and overrun statistics) of a data category
+        (of all data categories if None)
+        '''
+        categories = self._queues if data_category is None else [data_category]
+        return [consumer for category in categories for consumer in self._queues[category]
+                if isinstance(consumer, InlineConsumer)]
+
+    def queue_depths(self, data_category):
+        '''Return the number of data items waiting in the queue of each threaded callback'''
+        return [data_queue.qsize() for data_queue in self._queues[data_category]
+                if not isinstance(data_queue, InlineConsumer)]
+
     def enqueue_data(self, data_category, *data):
         '''Enqueue data of a given data category to be processed by corresponding callbacks.
 
         :param data_category: data category of the enqueued data
         :param data: arbitrary positional arguments forwarded to the matching callbacks
         '''
-        for data_queue in self._queues[data_category]:
-            data_queue.put(data)
+        for data_queue, data_filter in zip(self._queues[data_category],
+                                           self._filters[data_category]):
+            if data_filter is None:
+                data_queue.put(data)
+                continue
+            # filtered out data is never enqueued and never wakes the consumer thread
+            filtered = data_filter(data)
+            if filtered is not None:
+                data_queue.put(filtered)
 
     def shutdown(self):
         '''Stop consuming new data and wait up to timeout seconds for all threads to terminate.
@@ -82,4 +213,5 @@ class ConsumerPool():
                 data_queue.put(self._sentinel)
         for thread_list in self._threads.values():
             for thread in thread_list:
-                thread.join()
+                if thread is not None:
+                    thread.join()
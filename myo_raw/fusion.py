@@ -0,0 +1,127 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Time-aligned fusion of the EMG and IMU streams into synchronized frames'''
+
+import collections
+import threading
+import numpy as np
+from . import DataCategory, EMGMode, EMG_RATES
+
+FUSED_DTYPE = np.dtype([('timestamp', '<f8'), ('emg', '<i4', (8,)), ('quat', '<f4', (4,)),
+                        ('acc', '<f4', (3,)), ('gyro', '<f4', (3,))])
+
+class EMGIMUFusion():
+    '''Resample the IMU stream onto the EMG timeline and emit fused frames in batches.'''
+
+    def __init__(self, callback, mode='hold', batch_size=50, max_pending=200, imu_history=16):
+        '''
+        :param callback: function called with a structured array (FUSED_DTYPE) of fused frames
+        :param mode: IMU resampling mode - hold: last IMU sample at or before each EMG sample,
+          linear: linear interpolation between the surrounding IMU samples
+        :param batch_size: the number of fused frames passed to each callback call
+        :param max_pending: the maximum number of EMG samples waiting for a later IMU sample (the
+          oldest are fused with the latest IMU sample once exceeded, e.g. if the IMU is disabled,
+          or with NaN IMU fields if no IMU sample was received yet)
+        :param imu_history: the maximum number of buffered IMU samples
+        '''
+        if mode not in ('hold', 'linear'):
+            raise ValueError('mode must be hold or linear')
+        self.callback = callback
+        self.mode = mode
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._emg_times = collections.deque()
+        self._emg_values = collections.deque()
+        self._imu_times = collections.deque(maxlen=imu_history)
+        self._imu_values = collections.deque(maxlen=imu_history)
+        self._out = np.zeros(batch_size, FUSED_DTYPE)
+        self._out_count = 0
+        self._period = 1.0 / EMG_RATES[EMGMode.RAW]
+        self._second = False
+        self._last_emg = float('-inf')
+
+    def attach(self, myo):
+        '''Register the EMG and IMU handlers of the fusion stage on a MyoRaw instance'''
+        myo.add_handler(DataCategory.EMG, self.add_emg)
+        myo.add_handler(DataCategory.IMU, self.add_imu)
+
+    def add_emg(self, timestamp, emg, moving, characteristic_num):
+        '''Handler of EMG samples'''
+        # a raw EMG notification holds two consecutive samples received at the time of the later
+        first = characteristic_num is not None and not self._second
+        self._second = first
+        with self._lock:
+            if first:
+                # keep the timeline ordered if notifications arrive in quick succession
+                timestamp = max(timestamp - self._period, self._last_emg)
+            self._last_emg = timestamp
+            self._emg_times.append(timestamp)
+            self._emg_values.append(emg)
+            if len(self._emg_times) > self.max_pending or (
+                    self._imu_times and self._imu_times[-1] >= timestamp):
+                self._fuse()
+
+    def add_imu(self, timestamp, quat, acc, gyro):
+        '''Handler of IMU samples'''
+        with self._lock:
+            self._imu_times.append(timestamp)
+            self._imu_values.append(quat + acc + gyro)
+            if self._emg_times:
+                self._fuse()
+
+    def _fuse(self):
+        # fuse all EMG samples covered by the IMU samples and any exceeding the pending limit
+        emg_times = np.fromiter(self._emg_times, float, len(self._emg_times))
+        ready = len(emg_times) - self.max_pending
+        if self._imu_times:
+            ready = max(int(np.searchsorted(emg_times, self._imu_times[-1], side='right')), ready)
+        if ready <= 0:
+            return
+        emg_times = emg_times[:ready]
+        emg_values = np.array([self._emg_values.popleft() for _ in range(ready)])
+        for _ in range(ready):
+            self._emg_times.popleft()
+
+        if not self._imu_times:
+            self._store(emg_times, emg_values, np.full((ready, 10), np.nan, np.float32))
+            return
+        imu_times = np.array(self._imu_times)
+        imu_values = np.array(self._imu_values, dtype=np.float32)
+        index = np.searchsorted(imu_times, emg_times, side='right') - 1
+        if self.mode == 'hold' or len(imu_times) < 2:
+            imu = imu_values[np.clip(index, 0, len(imu_times) - 1)]
+        else:
+            index0 = np.clip(index, 0, len(imu_times) - 2)
+            span = imu_times[index0 + 1] - imu_times[index0]
+            weight = np.divide(emg_times - imu_times[index0], span, out=np.zeros_like(span),
+                               where=span > 0)
+            weight = np.clip(weight, 0, 1)[:, np.newaxis]
+            imu = imu_values[index0] + weight * (imu_values[index0 + 1] - imu_values[index0])
+        self._store(emg_times, emg_values, imu)
+
+    def _store(self, emg_times, emg_values, imu):
+        start = 0
+        while start < len(emg_times):
+            count = min(len(emg_times) - start, self.batch_size - self._out_count)
+            frames = self._out[self._out_count:self._out_count + count]
+            frames['timestamp'] = emg_times[start:start + count]
+            frames['emg'] = emg_values[start:start + count]
+            frames['quat'] = imu[start:start + count, 0:4]
+            frames['acc'] = imu[start:start + count, 4:7]
+            frames['gyro'] = imu[start:start + count, 7:10]
+            self._out_count += count
+            start += count
+            if self._out_count == self.batch_size:
+                self.flush()
+
+    def flush(self):
+        '''Pass all completed fused frames to the callback even if the batch is not full'''
+        if self._out_count:
+            batch, self._out = self._out[:self._out_count], np.zeros(self.batch_size, FUSED_DTYPE)
+            self._out_count = 0
+            self.callback(batch)
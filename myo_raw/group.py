@@ -0,0 +1,182 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Connect several Myo armbands through one BLED112 dongle each and merge their data'''
+
+import concurrent.futures
+import logging
+import queue
+import selectors
+import threading
+import time
+from . import MyoRaw
+
+LOG = logging.getLogger(__name__)
+
+class MyoGroup():
+    '''
+    A group of Myo armbands connected in parallel, one per BLED112 dongle. The data of all
+    armbands is received in a single thread and passed to the handlers of the group together with
+    the device id (the index of the armband in the group) as one merged stream.
+
+    Although a BLED112 can maintain several connections, the BLED112 backend (and MyoRaw) handles
+    a single connection, hence every armband requires its own dongle.
+    '''
+
+    def __init__(self, ttys=None, macs=None, cache=None, setup=None, **options):
+        '''
+        Connect and set up all armbands concurrently (one thread per dongle)
+
+        :param ttys: the device names of the BLED112 dongles (all detected dongles if None)
+        :param macs: the MAC addresses of the armbands per dongle (None or None entries to connect
+          to any Myo armband). Armbands without a MAC address are scanned for one dongle at a time
+          as concurrent scans would find the same armband.
+        :param cache: a DeviceCache used for the armbands given by their MAC address
+        :param setup: a function called with the device id and the MyoRaw instance of every armband
+          after connecting it (e.g. to subscribe and set the LEDs), run in the connecting thread
+        :param options: keyword arguments passed to every MyoRaw (e.g. scan_timeout)
+        '''
+        if ttys is None:
+            from .bled112 import detect_ttys
+            ttys = detect_ttys()
+        if not ttys:
+            raise ValueError('no Bluegiga BLED112 dongle found')
+        if len(set(ttys)) != len(ttys):
+            raise ValueError('every armband requires its own BLED112 dongle')
+        macs = list(macs) if macs is not None else [None] * len(ttys)
+        if len(macs) != len(ttys):
+            raise ValueError('one MAC address (or None) per dongle is required')
+        self.ttys = list(ttys)
+        self.setup_times = [None] * len(ttys)
+        self._scan_lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._consumer = None
+        started = time.time()
+        with concurrent.futures.ThreadPoolExecutor(len(ttys)) as executor:
+            futures = [executor.submit(self._connect, device_id, tty, mac, cache, setup, options)
+                       for device_id, (tty, mac) in enumerate(zip(ttys, macs))]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            for future in futures:
+                if future.exception() is None:
+                    future.result().disconnect()
+            raise errors[0]
+        self.devices = [future.result() for future in futures]
+        self.setup_time = time.time() - started
+        LOG.info('connected %d armbands in %.2f s (%.2f s one after another)', len(self.devices),
+                 self.setup_time, sum(self.setup_times))
+        self._selector = selectors.DefaultSelector()
+        for device in self.devices:
+            self._selector.register(device.fileno(), selectors.EVENT_READ, device)
+
+    def _connect(self, device_id, tty, mac, cache, setup, options):
+        if mac is None:
+            with self._scan_lock:
+                # the time spent waiting for the other scans is not part of the setup time
+                started = time.time()
+                myo = MyoRaw(tty, mac=None, **options)
+        else:
+            started = time.time()
+            myo = MyoRaw(tty, mac=mac, cache=cache, **options)
+        try:
+            if setup is not None:
+                setup(device_id, myo)
+        except Exception:
+            myo.disconnect()
+            raise
+        self.setup_times[device_id] = time.time() - started
+        LOG.info('armband %d (%s) on %s set up in %.2f s', device_id, myo.mac, tty,
+                 self.setup_times[device_id])
+        return myo
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.disconnect()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __getitem__(self, device_id):
+        return self.devices[device_id]
+
+    def add_handler(self, data_category, handler, inline=False, **kwargs):
+        '''
+        Add a handler to the data of a specific category of all armbands
+
+        :param data_category: the DataCategory
+        :param handler: the function called with the device id followed by the usual handler
+          arguments of the data category
+        :param inline: if true call the handler in the thread calling run, otherwise in the single
+          consumer thread of the group, which passes the data of all armbands and categories to the
+          handlers one at a time in the order of reception
+        :param kwargs: further arguments of MyoRaw.add_handler (e.g. decimation, applied per
+          armband)
+        '''
+        if inline:
+            for device_id, device in enumerate(self.devices):
+                device.add_handler(data_category, _tagged(device_id, handler), inline=True,
+                                   **kwargs)
+            return
+        if self._consumer is None:
+            self._consumer = threading.Thread(target=self._consume, name='group consumer')
+            self._consumer.start()
+        for device_id, device in enumerate(self.devices):
+            # the samples are forwarded right after decoding to keep the order of reception
+            forward = _forwarding(self._queue, device, device_id, data_category, handler)
+            device.add_handler(data_category, forward, inline=True, **kwargs)
+
+    def _consume(self):
+        item = self._queue.get()
+        while item is not None:
+            device, device_id, data_category, handler, data = item
+            hooks = device.hooks.callback_done
+            if hooks:
+                start = time.thread_time()
+                handler(device_id, *data)
+                elapsed = time.thread_time() - start
+                for hook in hooks:
+                    hook(data_category, handler, elapsed, data)
+            else:
+                handler(device_id, *data)
+            item = self._queue.get()
+
+    def run(self, timeout=None):
+        '''
+        Wait until any armband received data or until the given timeout has elapsed and process
+        the received data of all armbands
+
+        :param timeout: the maximum amount of time to wait for data
+        :returns: the number of handled notifications
+        '''
+        handled = 0
+        ready = set()
+        for key, _ in self._selector.select(timeout):
+            ready.add(key.data)
+            handled += key.data.pump()
+        # a lost link is only recovered while pumping
+        for device in self.devices:
+            if device not in ready and device._link_lost is not None:
+                handled += device.pump()
+        return handled
+
+    def disconnect(self):
+        '''Disconnect all armbands and wait for the consumer thread to pass on the queued data'''
+        self._selector.close()
+        for device in self.devices:
+            device.disconnect()
+        if self._consumer is not None:
+            self._queue.put(None)
+            self._consumer.join()
+            self._consumer = None
+
+
+def _tagged(device_id, handler):
+    return lambda *data: handler(device_id, *data)
+
+def _forwarding(data_queue, device, device_id, data_category, handler):
+    return lambda *data: data_queue.put((device, device_id, data_category, handler, data))
@@ -0,0 +1,62 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import time
+import numpy as np
+from . import records
+
+class RollingHistory():
+    '''A rolling history of the most recent records of a data category in a structured array.'''
+
+    def __init__(self, category, capacity):
+        '''
+        :param category: the data category of the records
+        :param capacity: the maximum number of records kept
+        '''
+        self.category = category
+        self.capacity = capacity
+        self.count = 0
+        # every record is stored twice (at i and i + capacity) so that any window of up to
+        # capacity records is a contiguous slice of the array
+        self._data = np.zeros(2 * capacity, records.dtype(category))
+        self._raw = memoryview(self._data.view(np.uint8))
+        self._size = self._data.dtype.itemsize
+
+    def append(self, *data):
+        '''Append a sample given by its handler arguments'''
+        record = records.pack(self.category, *data)
+        offset = self.count % self.capacity * self._size
+        mirror = offset + self.capacity * self._size
+        self._raw[offset:offset + self._size] = record
+        self._raw[mirror:mirror + self._size] = record
+        self.count += 1
+
+    def last(self, count=None):
+        '''
+        Return a view of the most recent records (oldest first) without copying. Note that the
+        view is overwritten once another capacity - count records have been appended.
+
+        :param count: the maximum number of records (all available if None)
+        :returns: a structured array view
+        '''
+        available = min(self.count, self.capacity)
+        count = available if count is None else min(count, available)
+        end = (self.count - 1) % self.capacity + self.capacity + 1 if self.count else 0
+        return self._data[end - count:end]
+
+    def since(self, timestamp):
+        '''
+        Return a view of all available records received after the given timestamp
+
+        :param timestamp: the start of the time window (as returned by time.time())
+        :returns: a structured array view
+        '''
+        view = self.last()
+        return view[np.searchsorted(view['timestamp'], timestamp, side='right'):]
+
+    def seconds(self, seconds):
+        '''Return a view of all available records of the last seconds'''
+        return self.since(time.time() - seconds)
@@ -0,0 +1,160 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Named hook points along the receive pipeline and collectors to profile it'''
+
+import enum
+import os
+import threading
+import time
+
+class HookPoint(enum.Enum):
+    '''
+    Hook points in the order a sample passes them and the arguments of their hooks
+
+    :FRAME_RECEIVED: the backend received a frame (a BLED112 Packet or an (attr, payload, arrival
+      time) tuple)
+    :NOTIFICATION_DECODED: a notification was decoded (timestamp, attr, payload)
+    :SAMPLE_ENQUEUED: a sample was passed to the handlers (data category, handler arguments)
+    :CALLBACK_DONE: a handler returned (data category, handler, consumed thread CPU time, handler
+      arguments)
+    '''
+    FRAME_RECEIVED = 0
+    NOTIFICATION_DECODED = 1
+    SAMPLE_ENQUEUED = 2
+    CALLBACK_DONE = 3
+
+class Hooks():
+    '''
+    Functions attached to the hook points, stored as tuples in attributes named after the hook
+    points (e.g. hooks.frame_received). Callers test the tuple before calling anything, so unused
+    hook points cost a single attribute lookup.
+    '''
+
+    def __init__(self):
+        for point in HookPoint:
+            setattr(self, point.name.lower(), ())
+        self._lock = threading.Lock()
+
+    def add(self, point, hook):
+        '''
+        Attach a function to a hook point
+
+        :param point: the HookPoint
+        :param hook: the function called with the arguments of the hook point
+        '''
+        with self._lock:
+            # replace the tuple to never change it while it is being iterated
+            name = point.name.lower()
+            setattr(self, name, getattr(self, name) + (hook,))
+
+    def remove(self, point, hook):
+        '''
+        Detach a function from a hook point
+
+        :param point: the HookPoint
+        :param hook: the function to be removed
+        '''
+        with self._lock:
+            name = point.name.lower()
+            hooks = list(getattr(self, name))
+            hooks.remove(hook)
+            setattr(self, name, tuple(hooks))
+
+
+class ReceiveProfiler():
+    '''A cProfile session enabled only while the receive thread processes data.'''
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.profile.disable()
+
+    def run(self, myo, duration):
+        '''
+        Call myo.run in the calling thread for the given duration under the profiler
+
+        :param myo: the MyoRaw instance
+        :param duration: the profiled time in seconds
+        '''
+        end = time.time() + duration
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                break
+            with self:
+                myo.run(remaining)
+
+    def stats(self, sort='cumulative'):
+        '''Return the collected pstats.Stats sorted by the given key'''
+        import pstats
+        return pstats.Stats(self.profile).sort_stats(sort)
+
+
+class AllocationTracker():
+    '''tracemalloc snapshots restricted to the allocations of the myo_raw package.'''
+
+    def __init__(self, frames=1):
+        '''
+        :param frames: the number of frames stored per allocation traceback
+        '''
+        import tracemalloc
+        self._tracemalloc = tracemalloc
+        self._filters = [tracemalloc.Filter(True, os.path.join(os.path.dirname(__file__), '*'))]
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start(frames)
+        self.baseline = self.snapshot()
+
+    def snapshot(self):
+        '''Take a snapshot of the current allocations of the package'''
+        return self._tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    def top(self, limit=10, key_type='lineno'):
+        '''Return the statistics of the largest allocation changes since the baseline snapshot'''
+        return self.snapshot().compare_to(self.baseline, key_type)[:limit]
+
+    def stop(self):
+        '''Stop tracing (if it was started by this tracker)'''
+        if self._started:
+            self._tracemalloc.stop()
+
+
+class HandlerTimer():
+    '''Accumulate the calls and the consumed CPU time of every handler.'''
+
+    def __init__(self, hooks):
+        '''
+        :param hooks: the Hooks of a MyoRaw instance (myo.hooks)
+        '''
+        self.hooks = hooks
+        self.calls = {}
+        self.cpu_time = {}
+        self._lock = threading.Lock()
+        hooks.add(HookPoint.CALLBACK_DONE, self._on_callback_done)
+
+    def _on_callback_done(self, category, handler, elapsed, data):
+        key = (category, handler)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.cpu_time[key] = self.cpu_time.get(key, 0.0) + elapsed
+
+    def stats(self):
+        '''Return (category, handler, calls, total CPU time, mean CPU time) tuples, costliest first'''
+        with self._lock:
+            result = [key + (self.calls[key], total, total / self.calls[key])
+                      for key, total in self.cpu_time.items()]
+        return sorted(result, key=lambda item: item[3], reverse=True)
+
+    def detach(self):
+        '''Stop timing the handlers'''
+        self.hooks.remove(HookPoint.CALLBACK_DONE, self._on_callback_done)
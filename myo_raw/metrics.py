@@ -0,0 +1,215 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Per-device and per-category stream metrics with an optional Prometheus HTTP endpoint'''
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import DataCategory
+from .hooks import HookPoint
+
+LOG = logging.getLogger(__name__)
+
+# weight of a new value in the exponential moving averages
+_ALPHA = 0.05
+
+class CategoryStats():
+    '''Counters of a single data category (updated by the hooks of a MyoRaw instance).'''
+
+    __slots__ = ('samples', 'rate', 'interval', 'jitter', 'latency', 'max_latency', '_second',
+                 '_second_count', '_last_arrival')
+
+    def __init__(self):
+        self.samples = 0
+        # samples received during the last complete second
+        self.rate = 0
+        # moving average and standard deviation of the time between two notifications
+        self.interval = 0.0
+        self.jitter = 0.0
+        # moving average and maximum of the time from receiving a sample to its handler returning
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self._second = 0
+        self._second_count = 0
+        self._last_arrival = None
+
+    def add_sample(self, timestamp):
+        self.samples += 1
+        second = int(timestamp)
+        if second != self._second:
+            self.rate = self._second_count if second == self._second + 1 else 0
+            self._second = second
+            self._second_count = 0
+        self._second_count += 1
+        # samples decoded from the same notification share the timestamp
+        last, self._last_arrival = self._last_arrival, timestamp
+        if last is None or timestamp == last:
+            return
+        delta = timestamp - last - self.interval
+        self.interval += _ALPHA * delta
+        variance = (1 - _ALPHA) * (self.jitter ** 2 + _ALPHA * delta ** 2)
+        self.jitter = variance ** 0.5
+
+    def current_rate(self, now):
+        '''Return the number of samples received during the last complete second before now'''
+        second = int(now)
+        if second == self._second:
+            return self.rate
+        if second == self._second + 1:
+            return self._second_count
+        return 0
+
+    def add_latency(self, latency):
+        self.latency += _ALPHA * (latency - self.latency)
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+
+class Metrics():
+    '''Collect stream metrics of a MyoRaw instance through its hook points.'''
+
+    def __init__(self, myo, device=None):
+        '''
+        :param myo: the MyoRaw instance
+        :param device: the device label of the metrics (the MAC address if None)
+        '''
+        self.myo = myo
+        self.device = device or myo.mac
+        self.categories = {category: CategoryStats() for category in DataCategory}
+        self._lock = threading.Lock()
+        myo.hooks.add(HookPoint.SAMPLE_ENQUEUED, self._on_sample)
+        myo.hooks.add(HookPoint.CALLBACK_DONE, self._on_callback_done)
+
+    def _on_sample(self, category, data):
+        self.categories[category].add_sample(data[0])
+
+    def _on_callback_done(self, category, handler, elapsed, data):
+        if category is DataCategory.GAP:
+            # a gap is stamped with the time the link was lost, not with its arrival
+            return
+        latency = time.time() - data[0]
+        with self._lock:
+            self.categories[category].add_latency(latency)
+
+    def snapshot(self):
+        '''
+        Return the current metrics
+
+        :returns: a dict with the device, the backend counters (notifications, parse errors and
+          dropped bytes) and a dict of the counters of each data category that has been received
+        '''
+        backend = self.myo.backend
+        result = {
+            'device': self.device,
+            'notifications': getattr(backend, 'notifications', 0),
+            'parse_errors': getattr(backend, 'parse_errors', 0),
+            'dropped_bytes': getattr(backend, 'buffer_dropped', 0),
+            'categories': {},
+        }
+        now = time.time()
+        for category, stats in self.categories.items():
+            if not stats.samples:
+                continue
+            result['categories'][category.name.lower()] = {
+                'samples': stats.samples,
+                'rate': stats.current_rate(now),
+                'interval': stats.interval,
+                'jitter': stats.jitter,
+                'queue_depth': sum(self.myo.cpool.queue_depths(category)),
+                'latency': stats.latency,
+                'max_latency': stats.max_latency,
+            }
+        return result
+
+    def detach(self):
+        '''Stop collecting metrics'''
+        self.myo.hooks.remove(HookPoint.SAMPLE_ENQUEUED, self._on_sample)
+        self.myo.hooks.remove(HookPoint.CALLBACK_DONE, self._on_callback_done)
+
+
+# name, type, help and the snapshot key of the exported metrics
+_DEVICE_METRICS = [
+    ('myo_notifications_total', 'counter', 'Notifications received', 'notifications'),
+    ('myo_parse_errors_total', 'counter', 'Bytes discarded while parsing frames', 'parse_errors'),
+    ('myo_dropped_bytes_total', 'counter', 'Bytes dropped due to a full receive buffer',
+     'dropped_bytes'),
+]
+_CATEGORY_METRICS = [
+    ('myo_samples_total', 'counter', 'Samples received', 'samples'),
+    ('myo_sample_rate', 'gauge', 'Samples received during the last second', 'rate'),
+    ('myo_interarrival_seconds', 'gauge', 'Mean time between notifications', 'interval'),
+    ('myo_interarrival_jitter_seconds', 'gauge', 'Standard deviation of the time between '
+     'notifications', 'jitter'),
+    ('myo_queue_depth', 'gauge', 'Samples waiting in the handler queues', 'queue_depth'),
+    ('myo_handler_latency_seconds', 'gauge', 'Mean time from receiving a sample to its handler '
+     'returning', 'latency'),
+    ('myo_handler_latency_max_seconds', 'gauge', 'Maximum time from receiving a sample to its '
+     'handler returning', 'max_latency'),
+]
+
+def prometheus_text(metrics):
+    '''
+    Format the snapshots of Metrics instances in the Prometheus text exposition format
+
+    :param metrics: an iterable of Metrics
+    :returns: the text
+    '''
+    snapshots = [item.snapshot() for item in metrics]
+    lines = []
+    for name, typ, description, key in _DEVICE_METRICS:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, typ))
+        for snapshot in snapshots:
+            lines.append('%s{device="%s"} %s' % (name, snapshot['device'], snapshot[key]))
+    for name, typ, description, key in _CATEGORY_METRICS:
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, typ))
+        for snapshot in snapshots:
+            for category, values in snapshot['categories'].items():
+                lines.append('%s{device="%s",category="%s"} %s' % (name, snapshot['device'],
+                                                                   category, values[key]))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer():
+    '''Serve Metrics in the Prometheus text format over HTTP from a background thread.'''
+
+    def __init__(self, metrics, address=('127.0.0.1', 9117)):
+        '''
+        :param metrics: a Metrics instance or a list of them (e.g. one per device)
+        :param address: the (host, port) to listen on
+        '''
+        self.metrics = metrics if isinstance(metrics, (list, tuple)) else [metrics]
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = prometheus_text(server.metrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOG.debug(format, *args)
+
+        self.httpd = ThreadingHTTPServer(address, Handler)
+        self.address = self.httpd.server_address
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        LOG.info('serving metrics on http://%s:%d/metrics', *self.address[:2])
+
+    def close(self):
+        '''Stop serving'''
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
@@ -6,34 +6,130 @@
 #
 
 import logging
-from bluepy import btle
+import os
+import select
+import threading
+import time
+from concurrent.futures import Future
+from .hooks import Hooks
+
+try:
+    from bluepy import btle
+    BTLEException, BTLEDisconnectError = btle.BTLEException, btle.BTLEDisconnectError
+except ImportError:
+    # without bluepy only a stub peripheral can be used (e.g. for testing), which reports errors
+    # with these stand-ins
+    btle = None
+
+    class BTLEException(Exception):
+        '''Stand-in for bluepy.btle.BTLEException'''
+
+    class BTLEDisconnectError(BTLEException):
+        '''Stand-in for bluepy.btle.BTLEDisconnectError'''
 
 LOG = logging.getLogger(__name__)
 
-class Delegate(btle.DefaultDelegate):
-    '''Store handlers to be called from a bluepy Peripheral on receiving notifications'''
+# the maximum number of notifications passed on as one batch
+MAX_BATCH = 64
+# the timeout used to poll a stub peripheral (without a bluepy helper process) for notifications
+STUB_POLL_TIMEOUT = 0.001
+
+class Delegate():
+    '''Collect notifications received by a bluepy Peripheral to pass them on as a batch'''
 
     def __init__(self):
-        super().__init__()
         self.handler = None
+        self.pending = []
 
     def handleNotification(self, cHandle, data):
-        if self.handler:
-            self.handler(cHandle, data)
+        # stamp each notification on arrival as a batch is only passed on after draining
+        self.pending.append((cHandle, data, time.time()))
+
+    def handleDiscovery(self, scanEntry, isNewDev, isNewData):
+        pass
+
+    def flush(self):
+        '''Pass all collected notifications to the handler and return their number'''
+        pending, self.pending = self.pending, []
+        if pending and self.handler:
+            self.handler(pending)
+        return len(pending)
+
+class HelperOutput():
+    '''
+    Line reader replacing the buffered text pipe of a bluepy helper process. Unlike the text pipe
+    it tells whether a line can be read without blocking, including lines read ahead from the pipe.
+    '''
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._fd = stdout.fileno()
+        self._buf = bytearray()
+        self._eof = False
+
+    def fileno(self):
+        return self._fd
+
+    def pending(self):
+        '''Return true if a line (or the end of the output) can be read without blocking'''
+        if self._eof or b'\n' in self._buf:
+            return True
+        if select.select([self._fd], [], [], 0)[0]:
+            self._fill()
+        return self._eof or b'\n' in self._buf
+
+    def wait(self, timeout=None):
+        '''Wait until the pipe is readable or until the given timeout has elapsed'''
+        return self.pending() or bool(select.select([self._fd], [], [], timeout)[0])
 
-class Native(btle.Peripheral):
+    def _fill(self):
+        data = os.read(self._fd, 1 << 16)
+        if data:
+            self._buf += data
+        else:
+            self._eof = True
+
+    def readline(self):
+        while b'\n' not in self._buf and not self._eof:
+            self._fill()
+        end = self._buf.find(b'\n') + 1 or len(self._buf)
+        line = self._buf[:end].decode('utf-8')
+        del self._buf[:end]
+        return line
+
+    def close(self):
+        self._stdout.close()
+
+
+class Native():
     '''Non-Myo-specific Bluetooth backend based on a bluepy to use standard Bluetooth adapters.'''
 
-    def __init__(self):
-        super().__init__()
-        self.withDelegate(Delegate())
+    def __init__(self, peripheral=None):
+        '''
+        :param peripheral: the bluepy Peripheral (or a compatible stub without a helper process,
+          which is polled by waitForNotifications with STUB_POLL_TIMEOUT) used to communicate
+        '''
+        if peripheral is None:
+            if btle is None:
+                raise ImportError('bluepy is required to use a native Bluetooth adapter')
+            peripheral = btle.Peripheral()
+        self.peripheral = peripheral
+        self.delegate = Delegate()
+        self.peripheral.withDelegate(self.delegate)
+        self.disconnect_handler = None
+        self.hooks = Hooks()
+        self.notifications = 0
+        self._connecting = None
         LOG.debug('using bluepy backend')
 
     @staticmethod
-    def scan(target_uuid, target_address=None):
+    def scan(target_uuid, target_address=None, timeout=None):
+        if btle is None:
+            raise ImportError('bluepy is required to use a native Bluetooth adapter')
         LOG.info('scanning for devices...')
         scanner = btle.Scanner()
-        while True:
+        t0 = time.time()
+        while timeout is None or time.time() < t0 + timeout:
             devices = scanner.scan(timeout=1)
             for dev in devices:
                 uuid = next(item[2] for item in dev.getScanData() if item[0] == 6)
@@ -41,6 +137,59 @@ class Native(btle.Peripheral):
                     LOG.debug('found a Bluetooth device (MAC address: %s)', dev.addr)
                     if target_address is None or target_address.lower() == dev.addr:
                         return dev.addr
+        return None
+
+    def connect(self, target_address, timeout=None, params=None):
+        # bluepy applies its own connection timeout and bluez the configured connection parameters
+        if params is not None:
+            LOG.debug('connection parameters are set by bluez (see README)')
+        self.peripheral.connect(target_address)
+        # replace the output of the new helper process before any notification is read ahead
+        self._output()
+
+    def submit_connect(self, target_address, params=None):
+        '''
+        Connect in a background thread (bluepy connects synchronously)
+
+        :returns: a future resolved once connected (the pending one if already connecting)
+        '''
+        if self._connecting is not None:
+            return self._connecting[1]
+        connected = Future()
+        def connect():
+            try:
+                self.connect(target_address, params=params)
+            except BTLEException as err:
+                connected.set_exception(err)
+            else:
+                # callbacks may replay state on the peripheral before receiving is resumed
+                connected.set_result(None)
+            finally:
+                self._connecting = None
+        thread = threading.Thread(target=connect, name='bluepy connect', daemon=True)
+        self._connecting = (thread, connected)
+        thread.start()
+        return connected
+
+    @staticmethod
+    def cancel_connect(connected):
+        # bluepy cannot abort a connection attempt, it fails on its own timeout
+        pass
+
+    def disconnect(self):
+        self.peripheral.disconnect()
+
+    @staticmethod
+    def update_connection(params):
+        raise NotImplementedError('bluepy cannot update connection parameters (see README)')
+
+    @staticmethod
+    def submit_rssi():
+        raise NotImplementedError('bluepy cannot read the RSSI of a connection')
+
+    @staticmethod
+    def submit_connection_status():
+        raise NotImplementedError('bluepy cannot read the status of a connection')
 
     @property
     def handler(self):
@@ -51,10 +200,131 @@ class Native(btle.Peripheral):
         self.delegate.handler = func if callable(func) else None
 
     def recv_packet(self, timeout=None):
-        self.waitForNotifications(timeout)
+        connecting = self._connecting
+        if connecting is not None:
+            # the peripheral is busy connecting in the background
+            connecting[0].join(timeout)
+            return
+        try:
+            # wait for the first notification and then pass on all pending ones as a batch
+            output = self._output()
+            if output is None:
+                if self.peripheral.waitForNotifications(timeout):
+                    self._drain(1)
+            elif output.wait(timeout):
+                self._drain()
+        except BTLEDisconnectError as err:
+            self._on_error(err)
+        self._flush()
+
+    def _output(self):
+        '''Return the HelperOutput of the bluepy helper process (None for a stub peripheral)'''
+        if not hasattr(self.peripheral, '_helper'):
+            return None
+        helper = self.peripheral._helper
+        if helper is None:
+            raise BTLEDisconnectError('not connected')
+        if not isinstance(helper.stdout, HelperOutput):
+            helper.stdout = HelperOutput(helper.stdout)
+        return helper.stdout
+
+    def _drain(self, count=0):
+        '''
+        Read the notifications which are pending without waiting for further ones (up to
+        MAX_BATCH including count already read ones) and pass them on
+
+        :returns: true if further notifications may be pending in the helper output
+        '''
+        output = self._output()
+        try:
+            while count < MAX_BATCH:
+                if output is None:
+                    if not self.peripheral.waitForNotifications(STUB_POLL_TIMEOUT):
+                        break
+                elif output.pending():
+                    # bluepy only polls its helper for a positive timeout (not seeing lines read
+                    # ahead), without a timeout it reads the pending line directly
+                    self.peripheral.waitForNotifications(0)
+                else:
+                    break
+                count += 1
+        finally:
+            self._flush()
+        return output is not None and count == MAX_BATCH
+
+    def fileno(self):
+        '''
+        Return the file descriptor of the output of the bluepy helper process (pump passes on the
+        lines read ahead from it, so the descriptor is only readable once new data arrives)
+        '''
+        output = self._output()
+        if output is None:
+            raise NotImplementedError('the peripheral has no bluepy helper process to select on')
+        return output.fileno()
+
+    def pump(self):
+        '''
+        Process all notifications received so far without blocking
+
+        :returns: the number of handled notifications
+        '''
+        if self._connecting is not None:
+            return 0
+        notifications = self.notifications
+        try:
+            # drain the lines read ahead as well, a selector would not report them
+            while self._drain():
+                pass
+        except BTLEDisconnectError as err:
+            self._on_error(err)
+        self._flush()
+        return self.notifications - notifications
+
+    def _on_error(self, err):
+        if self.disconnect_handler is None:
+            raise err
+        LOG.warning('connection lost (%s)', err)
+        self.disconnect_handler(err)
+
+    def _flush(self):
+        hooks = self.hooks.frame_received
+        if hooks:
+            for notification in self.delegate.pending:
+                for hook in hooks:
+                    hook(notification)
+        self.notifications += self.delegate.flush()
+
+    def close(self):
+        # nothing left to release after disconnecting from the bluepy helper
+        pass
 
     def read_attr(self, attr):
-        return self.readCharacteristic(attr)
+        value = self.peripheral.readCharacteristic(attr)
+        # pass on notifications received while waiting for the response
+        self._flush()
+        return value
 
     def write_attr(self, attr, val, wait_response=True):
-        return self.writeCharacteristic(attr, val, withResponse=wait_response)
+        response = self.peripheral.writeCharacteristic(attr, val, withResponse=wait_response)
+        self._flush()
+        return response
+
+    def submit_read_attr(self, attr):
+        return self._completed(self.read_attr, attr)
+
+    def submit_write_attr(self, attr, val, wait_response=True):
+        return self._completed(self.write_attr, attr, val, wait_response)
+
+    @staticmethod
+    def wait(futures, timeout=None):
+        # bluepy executes each procedure synchronously, hence all futures are already resolved
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _completed(func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except BTLEException as err:
+            future.set_exception(err)
+        return future
@@ -0,0 +1,183 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Detect the onset and offset of muscle activation on each EMG channel'''
+
+import logging
+import numpy as np
+from . import DataCategory, EMG_RATES
+
+LOG = logging.getLogger(__name__)
+
+class OnsetDetector():
+    '''
+    Track the envelope (exponential moving average of the rectified EMG) and its resting baseline
+    on each channel in blocks of samples. An onset is detected once the envelope rises above the
+    baseline by a multiple of its standard deviation and an offset once it falls back below a
+    fraction of that rise. Consecutive events of a channel are separated by a refractory period.
+    The events are stamped with the time of the sample that crossed the threshold.
+    '''
+
+    def __init__(self, myo=None, rate=None, block_size=8, time_constant=0.05,
+                 baseline_time_constant=5.0, threshold=4.0, release=0.5, min_rise=1.0,
+                 refractory=0.1, warmup=1.0):
+        '''
+        :param myo: the subscribed MyoRaw instance (None to only process samples with feed)
+        :param rate: the EMG sampling rate (the rate of the subscribed EMG mode of myo if None)
+        :param block_size: the maximum number of samples processed at once (received samples are
+          processed as soon as their notification is complete, feed processes blocks of this size)
+        :param time_constant: the time constant of the envelope in seconds
+        :param baseline_time_constant: the time constant of the baseline and its deviation in
+          seconds (only updated from blocks without activity)
+        :param threshold: the rise of the envelope above the baseline at an onset in standard
+          deviations of the baseline
+        :param release: the fraction of the onset rise the envelope has to fall below at an offset
+        :param min_rise: the minimum rise at an onset (in the units of the EMG mode)
+        :param refractory: the minimum time in seconds between two events of a channel
+        :param warmup: the time in seconds to learn the baseline before detecting events
+        '''
+        if rate is None:
+            rate = EMG_RATES[myo.subscription['emg_mode']]
+        self.myo = myo
+        self.block_size = block_size
+        self.time_constant = time_constant
+        self.baseline_time_constant = baseline_time_constant
+        self.threshold = threshold
+        self.release = release
+        self.min_rise = min_rise
+        self.refractory = refractory
+        self.warmup = warmup
+        self.events = 0
+        self._times = np.zeros(block_size)
+        self._values = np.zeros((block_size, 8), np.float32)
+        self._count = 0
+        self._second = False
+        self._configure(rate)
+
+    def attach(self):
+        '''Register the detector as inline EMG and EMG_MODE handler of its MyoRaw instance'''
+        self.myo.add_handler(DataCategory.EMG, self, inline=True)
+        self.myo.add_handler(DataCategory.EMG_MODE, self.on_emg_mode, inline=True)
+
+    def _configure(self, rate):
+        self.rate = rate
+        self._period = 1.0 / rate
+        alpha = 1.0 - np.exp(-self._period / self.time_constant)
+        # the envelope of a block is a linear function of the envelope before the block and the
+        # samples of the block: envelope[i] = decay[i] * envelope + weights[i] @ samples
+        steps = np.arange(self.block_size)
+        lags = steps[:, np.newaxis] - steps
+        self._weights = np.where(lags >= 0, alpha * (1.0 - alpha) ** np.maximum(lags, 0), 0.0)
+        self._weights = self._weights.astype(np.float32)
+        self._decay = ((1.0 - alpha) ** (steps + 1)).astype(np.float32)[:, np.newaxis]
+        self._baseline_alpha = 1.0 - np.exp(-self._period / self.baseline_time_constant)
+        self._refractory = int(round(self.refractory * rate))
+        self._warmup = int(round(self.warmup * rate))
+        self.reset()
+
+    def reset(self):
+        '''Forget the envelope, the baseline and the activity of all channels'''
+        self.envelope = np.zeros(8, np.float32)
+        self.baseline = None
+        self.deviation = None
+        self.active = np.zeros(8, bool)
+        self._position = 0
+        self._last_event = np.full(8, -self._refractory, np.int64)
+
+    def on_emg_mode(self, timestamp, emg_mode, rate):
+        '''Inline handler of EMG mode changes (restarting the detection at the new rate)'''
+        self._flush()
+        if rate:
+            LOG.debug('restarting onset detection at %d Hz', rate)
+            self._configure(rate)
+
+    def __call__(self, timestamp, emg, moving, characteristic_num):
+        '''Inline handler of EMG samples'''
+        # a raw EMG notification holds two consecutive samples received at the time of the later
+        first = characteristic_num is not None and not self._second
+        self._second = first
+        self._times[self._count] = timestamp - self._period if first else timestamp
+        self._values[self._count] = emg
+        self._count += 1
+        # process the samples once their notification is complete to never wait for the next one
+        if not first or self._count == self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._count:
+            return
+        events = []
+        self._process(self._times[:self._count], self._values[:self._count], events)
+        self._count = 0
+        for event in events:
+            self.myo._emit(DataCategory.ONSET, *event)
+
+    def feed(self, timestamps, emg):
+        '''
+        Process consecutive samples (e.g. of a recording) and return the detected events
+
+        :param timestamps: the timestamps of the samples
+        :param emg: the EMG values of the samples with shape (n, 8)
+        :returns: a list of (timestamp, channel, onset, envelope) tuples where onset is True at an
+          onset and False at an offset
+        '''
+        timestamps = np.asarray(timestamps, float)
+        emg = np.asarray(emg, np.float32)
+        events = []
+        for start in range(0, len(emg), self.block_size):
+            stop = start + self.block_size
+            self._process(timestamps[start:stop], emg[start:stop], events)
+        return events
+
+    def _process(self, times, values, events):
+        count = len(values)
+        envelope = self._weights[:count, :count] @ np.abs(values)
+        envelope += self._decay[:count] * self.envelope
+        self.envelope = envelope[-1]
+        first = self._position
+        self._position += count
+        if self.baseline is None:
+            self.baseline = envelope.mean(axis=0)
+            self.deviation = envelope.std(axis=0)
+        if first < self._warmup:
+            self._update_baseline(envelope, np.ones(8, bool))
+            return
+
+        rise = np.maximum(self.threshold * self.deviation, self.min_rise)
+        above = envelope > self.baseline + rise
+        below = envelope < self.baseline + self.release * rise
+        # only the channels which may change their state are processed one by one
+        quiet = ~self.active & ~above.any(axis=0)
+        candidates = np.where(self.active, below.any(axis=0), above.any(axis=0))
+        block_events = []
+        for channel in np.flatnonzero(candidates):
+            index = 0
+            while True:
+                index = max(index, self._last_event[channel] + self._refractory - first)
+                if index >= count:
+                    break
+                crossing = (below if self.active[channel] else above)[index:, channel]
+                if not crossing.any():
+                    break
+                index += int(crossing.argmax())
+                self.active[channel] = not self.active[channel]
+                self._last_event[channel] = first + index
+                block_events.append((float(times[index]), int(channel),
+                                     bool(self.active[channel]), float(envelope[index, channel])))
+                index += 1
+        self.events += len(block_events)
+        events.extend(sorted(block_events))
+        self._update_baseline(envelope, quiet)
+
+    def _update_baseline(self, envelope, channels):
+        # blend in the statistics of the block as if the samples were added one by one
+        weight = 1.0 - (1.0 - self._baseline_alpha) ** len(envelope)
+        mean = envelope.mean(axis=0)
+        variance = ((envelope - self.baseline) ** 2).mean(axis=0)
+        self.baseline = np.where(channels, self.baseline + weight * (mean - self.baseline),
+                                 self.baseline)
+        self.deviation = np.where(channels, np.sqrt(self.deviation ** 2 + weight * (
+            variance - self.deviation ** 2)), self.deviation)
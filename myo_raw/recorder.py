@@ -0,0 +1,244 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Record all data categories of a Myo armband into rotating compressed recordings'''
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from . import DataCategory, EMGMode, MyoRaw
+from . import records
+from .recording import CODECS, RecordingWriter
+
+LOG = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('never', 'rotate', 'batch')
+
+class Recorder():
+    '''Collect samples in batches and write them from a background thread into rotating files.'''
+
+    def __init__(self, outdir='.', prefix='myo', compression='zlib', rotate_size=None,
+                 rotate_seconds=None, fsync='rotate', batch_interval=1.0, chunk_size=4096):
+        '''
+        :param outdir: the directory of the recordings
+        :param prefix: the file name prefix of the recordings
+        :param compression: the compression codec (zlib, lzma or none)
+        :param rotate_size: start a new file once this many bytes have been written (no limit if
+          None)
+        :param rotate_seconds: start a new file after this many seconds (no limit if None)
+        :param fsync: when to force the data onto the disk
+
+          :never: leave it to the operating system
+          :rotate: when a file is completed
+          :batch: after every batch (writes partial chunks)
+
+        :param batch_interval: the time in seconds samples are collected before being handed to
+          the writer thread
+        :param chunk_size: the number of records of a stream per chunk
+        '''
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('fsync must be one of ' + ', '.join(FSYNC_POLICIES))
+        self.outdir = outdir
+        self.prefix = prefix
+        self.compression = compression
+        self.rotate_size = rotate_size
+        self.rotate_seconds = rotate_seconds
+        self.fsync = fsync
+        self.batch_interval = batch_interval
+        self.chunk_size = chunk_size
+        self.files = []
+        self.records = dict.fromkeys(DataCategory, 0)
+        self.bytes_raw = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self.max_backlog = 0
+        os.makedirs(outdir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._batches = {category: bytearray() for category in DataCategory}
+        self._queue = queue.Queue()
+        self._writer = None
+        self._file_started = None
+        self._started = time.time()
+        self._stopped = None
+        self._running = True
+        self._threads = [threading.Thread(target=self._collect, daemon=True),
+                         threading.Thread(target=self._write, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def attach(self, myo):
+        '''Register handlers for all data categories on a MyoRaw instance'''
+        for category in DataCategory:
+            myo.add_handler(category, self.handler(category))
+
+    def handler(self, category):
+        '''Return a handler appending the samples of a data category to the current batch'''
+        record_format = records.FORMATS[category]
+        batch = self._batches[category]
+        def handle(*data):
+            packed = record_format.pack(*records.flatten(category, *data))
+            with self._lock:
+                batch.extend(packed)
+        return handle
+
+    @property
+    def backlog(self):
+        '''The number of batches waiting for the writer thread'''
+        return self._queue.qsize()
+
+    def _collect(self):
+        while self._running:
+            time.sleep(self.batch_interval)
+            self._hand_over()
+
+    def _hand_over(self):
+        with self._lock:
+            batches = [(category, bytes(batch)) for category, batch in self._batches.items()
+                       if batch]
+            for batch in self._batches.values():
+                del batch[:]
+        if batches:
+            self._queue.put(batches)
+            self.max_backlog = max(self.max_backlog, self._queue.qsize())
+
+    def _write(self):
+        while True:
+            batches = self._queue.get()
+            if batches is None:
+                break
+            started = time.perf_counter()
+            if self._writer is None or self._rotation_due():
+                self._rotate()
+            for category, data in batches:
+                array = np.frombuffer(data, records.dtype(category))
+                self._writer.append(category.name.lower(), array)
+                self.records[category] += len(array)
+                self.bytes_raw += len(data)
+            if self.fsync == 'batch':
+                self._writer.flush(fsync=True)
+            self.write_time += time.perf_counter() - started
+        self._close_file()
+
+    def _rotation_due(self):
+        if self.rotate_size is not None and self._writer.bytes_written >= self.rotate_size:
+            return True
+        return self.rotate_seconds is not None and \
+            time.time() - self._file_started >= self.rotate_seconds
+
+    def _rotate(self):
+        self._close_file()
+        self._file_started = time.time()
+        now = datetime.fromtimestamp(self._file_started).strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(self.outdir, '{}_{}_{:04d}.myorec'.format(self.prefix, now,
+                                                                      len(self.files)))
+        self._writer = RecordingWriter(path, self.compression, chunk_size=self.chunk_size)
+        self.files.append(path)
+        LOG.info('recording into %s', path)
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close(fsync=self.fsync != 'never')
+            self.bytes_written += self._writer.bytes_written
+            self._writer = None
+
+    def close(self):
+        '''Write all collected samples, close the current file and stop the background threads'''
+        self._running = False
+        self._threads[0].join()
+        self._hand_over()
+        backlog = self.backlog
+        self._queue.put(None)
+        self._threads[1].join()
+        self._stopped = time.time()
+        if backlog:
+            LOG.info('%d batches were still waiting to be written when stopping', backlog)
+
+    def report(self):
+        '''Return a summary of the recording (records, bytes, throughput and backlog)'''
+        elapsed = (self._stopped or time.time()) - self._started
+        total = sum(self.records.values())
+        return {
+            'files': list(self.files),
+            'records': {category.name: count for category, count in self.records.items()},
+            'bytes_raw': self.bytes_raw,
+            'bytes_written': self.bytes_written,
+            'elapsed': elapsed,
+            'records_per_second': total / elapsed if elapsed else 0.0,
+            # sustained rate of the writer thread while it was busy
+            'write_throughput': self.bytes_raw / self.write_time if self.write_time else 0.0,
+            'write_load': self.write_time / elapsed if elapsed else 0.0,
+            'max_backlog': self.max_backlog,
+            'backlog': self.backlog,
+        }
+
+
+def _parse_size(size):
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    if size[-1].lower() in units:
+        return int(float(size[:-1]) * units[size[-1].lower()])
+    return int(size)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--tty', default=None, help='The Myo dongle device (autodetected if omitted)')
+    group.add_argument('--native', default=False, action='store_true',
+                       help='Use a native Bluetooth stack')
+    parser.add_argument('--mac', default=None,
+                        help='The Myo MAC address (arbitrarily detected if omitted)')
+    modes = ', '.join([str(item.value) + ': ' + item.name for item in EMGMode])
+    parser.add_argument('--emg_mode', type=int, default=EMGMode.RAW,
+                        choices=[m.value for m in EMGMode],
+                        help='Choose the EMG receiving mode ({0} - default: %(default)s)'.format(modes))
+    parser.add_argument('-o', '--outdir', default='.', help='Directory of the recordings')
+    parser.add_argument('--prefix', default='myo', help='File name prefix (default: %(default)s)')
+    parser.add_argument('--compression', default='zlib', choices=sorted(CODECS),
+                        help='Compression codec (default: %(default)s)')
+    parser.add_argument('--rotate-size', type=_parse_size, default=None,
+                        help='Start a new file after this size (e.g. 100M)')
+    parser.add_argument('--rotate-seconds', type=float, default=None,
+                        help='Start a new file after this duration')
+    parser.add_argument('--fsync', default='rotate', choices=FSYNC_POLICIES,
+                        help='When to force data onto the disk (default: %(default)s)')
+    parser.add_argument('--batch-interval', type=float, default=1.0,
+                        help='Seconds of data per write batch (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+    logging.basicConfig(level=max(2 - args.verbose, 0) * 10)
+
+    recorder = Recorder(args.outdir, args.prefix, args.compression, args.rotate_size,
+                        args.rotate_seconds, args.fsync, args.batch_interval)
+    myo = MyoRaw(args.tty, args.native, args.mac)
+    recorder.attach(myo)
+    myo.subscribe(args.emg_mode)
+    myo.set_sleep_mode(1)
+    myo.vibrate(1)
+    try:
+        while True:
+            myo.run(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        myo.disconnect()
+        recorder.close()
+        report = recorder.report()
+        print('Disconnected')
+        for category, count in report['records'].items():
+            if count:
+                print('{:>8}: {} records'.format(category, count))
+        print('written: {} files, {:.1f} MB ({:.1f} MB raw, {:.0f} records/s)'.format(
+            len(report['files']), report['bytes_written'] / 1e6, report['bytes_raw'] / 1e6,
+            report['records_per_second']))
+        print('writer: {:.1f} MB/s sustained, {:.1%} busy, max backlog {} batches'.format(
+            report['write_throughput'] / 1e6, report['write_load'], report['max_backlog']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Chunked, delta-encoded and compressed recordings with a random-access index by timestamp'''
+
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+from . import records
+
+MAGIC = b'MYOREC01'
+# every chunk: magic, length of its JSON description and length of the compressed data
+CHUNK = struct.Struct('<4sII')
+CHUNK_MAGIC = b'CHNK'
+# end of a completely written file: offset of the JSON index and magic
+TRAILER = struct.Struct('<Q8s')
+TRAILER_MAGIC = b'MYOIDX01'
+
+CODECS = {
+    'none': (lambda data, level: data, lambda data: data),
+    'zlib': (lambda data, level: zlib.compress(data, 6 if level is None else level),
+             zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+def _delta_view(column):
+    # floats are delta encoded through their integer bit patterns to stay lossless
+    if column.dtype.kind == 'f':
+        return column.view('<i%d' % column.dtype.itemsize)
+    return column
+
+def encode(array):
+    '''Delta encode each field of a structured array and return the fields one after another'''
+    parts = []
+    for name in array.dtype.names:
+        column = np.ascontiguousarray(_delta_view(np.ascontiguousarray(array[name])))
+        delta = column.copy()
+        # integer differences wrap around and are restored exactly by the cumulative sum
+        delta[1:] = column[1:] - column[:-1]
+        parts.append(delta.tobytes())
+    return b''.join(parts)
+
+def decode(data, dtype, count):
+    '''Restore a structured array from delta encoded fields'''
+    array = np.empty(count, dtype)
+    offset = 0
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        column = _delta_view(np.empty((count,) + field.shape, field.base))
+        size = column.nbytes
+        delta = np.frombuffer(data, column.dtype, column.size, offset).reshape(column.shape)
+        np.cumsum(delta, axis=0, dtype=column.dtype, out=column)
+        array[name] = column.view(field.base)
+        offset += size
+    return array
+
+
+class RecordingWriter():
+    '''Write streams of structured records into a chunked and compressed recording.'''
+
+    def __init__(self, path, compression='zlib', level=None, chunk_size=4096):
+        '''
+        :param path: the file to be written
+        :param compression: the compression codec (zlib, lzma or none)
+        :param level: the compression level (codec default if None)
+        :param chunk_size: the number of records of a stream per chunk
+        '''
+        if compression not in CODECS:
+            raise ValueError('unknown compression %s' % compression)
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.chunk_size = chunk_size
+        self.index = []
+        self.bytes_raw = 0
+        self.bytes_written = len(MAGIC)
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._dtypes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def append(self, stream, array):
+        '''
+        Append records to a stream
+
+        :param stream: the name of the stream
+        :param array: a structured array with a timestamp field (sorted by time)
+        '''
+        with self._lock:
+            self._append(stream, array.dtype, array.tobytes())
+
+    def append_sample(self, category, *data):
+        '''Append a single sample given by its handler arguments to the stream of its category'''
+        with self._lock:
+            self._append(category.name.lower(), None, records.pack(category, *data), category)
+
+    def handler(self, category):
+        '''Return a handler recording the samples of a data category (see MyoRaw.add_handler)'''
+        return lambda *data: self.append_sample(category, *data)
+
+    def _append(self, stream, dtype, data, category=None):
+        if stream not in self._buffers:
+            self._dtypes[stream] = dtype if dtype is not None else records.dtype(category)
+            self._buffers[stream] = bytearray()
+        buf = self._buffers[stream]
+        buf += data
+        if len(buf) >= self.chunk_size * self._dtypes[stream].itemsize:
+            self._write_chunk(stream)
+
+    def _write_chunk(self, stream):
+        dtype = self._dtypes[stream]
+        array = np.frombuffer(bytes(self._buffers[stream]), dtype)
+        self._buffers[stream] = bytearray()
+        if not len(array):
+            return
+        data = CODECS[self.compression][0](encode(array), self.level)
+        entry = {
+            'stream': stream,
+            'dtype': dtype.descr,
+            'codec': self.compression,
+            'count': len(array),
+            'start': float(array['timestamp'][0]),
+            'end': float(array['timestamp'][-1]),
+        }
+        description = json.dumps(entry).encode('utf-8')
+        entry['offset'] = self._file.tell()
+        self._file.write(CHUNK.pack(CHUNK_MAGIC, len(description), len(data)))
+        self._file.write(description)
+        self._file.write(data)
+        self.index.append(entry)
+        self.bytes_raw += array.nbytes
+        self.bytes_written += CHUNK.size + len(description) + len(data)
+
+    def flush(self, fsync=False):
+        '''
+        Write all buffered records as (possibly partial) chunks
+
+        :param fsync: if true also force the data onto the disk
+        '''
+        with self._lock:
+            for stream in self._buffers:
+                self._write_chunk(stream)
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self, fsync=False):
+        '''
+        Write the remaining records and the index and close the file
+
+        :param fsync: if true force the file onto the disk before closing it
+        '''
+        if self._file.closed:
+            return
+        self.flush()
+        with self._lock:
+            offset = self._file.tell()
+            index = json.dumps(self.index).encode('utf-8')
+            self._file.write(index)
+            self._file.write(TRAILER.pack(offset, TRAILER_MAGIC))
+            self.bytes_written += len(index) + TRAILER.size
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+
+class RecordingReader():
+    '''Random access to the streams of a recording by time range.'''
+
+    def __init__(self, path):
+        '''
+        :param path: the recording to be read (the index of a recording which has not been
+          closed properly is rebuilt by scanning its chunks)
+        '''
+        self.path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a myo_raw recording' % path)
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan_chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def _read_index(self):
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size < len(MAGIC) + TRAILER.size:
+            return None
+        self._file.seek(size - TRAILER.size)
+        offset, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != TRAILER_MAGIC:
+            return None
+        self._file.seek(offset)
+        return json.loads(self._file.read(size - TRAILER.size - offset).decode('utf-8'))
+
+    def _scan_chunks(self):
+        size = self._file.seek(0, 2)
+        index = []
+        offset = len(MAGIC)
+        self._file.seek(offset)
+        while True:
+            header = self._file.read(CHUNK.size)
+            if len(header) < CHUNK.size:
+                break
+            magic, description_len, data_len = CHUNK.unpack(header)
+            description = self._file.read(description_len)
+            if magic != CHUNK_MAGIC or len(description) < description_len:
+                break
+            entry = json.loads(description.decode('utf-8'))
+            entry['offset'] = offset
+            offset += CHUNK.size + description_len + data_len
+            # ignore a truncated chunk at the end of the file
+            if offset > size:
+                break
+            self._file.seek(offset)
+            index.append(entry)
+        return index
+
+    @property
+    def streams(self):
+        '''The names of all recorded streams'''
+        return sorted({entry['stream'] for entry in self.index})
+
+    def dtype(self, stream):
+        '''Return the structured dtype of a stream'''
+        for entry in self.index:
+            if entry['stream'] == stream:
+                return np.dtype([tuple(field) for field in entry['dtype']])
+        raise KeyError(stream)
+
+    def time_range(self, stream):
+        '''Return the first and last timestamp of a stream'''
+        entries = [entry for entry in self.index if entry['stream'] == stream]
+        return min(entry['start'] for entry in entries), max(entry['end'] for entry in entries)
+
+    def count(self, stream):
+        '''Return the number of records of a stream'''
+        return sum(entry['count'] for entry in self.index if entry['stream'] == stream)
+
+    def read_slice(self, stream, start, stop):
+        '''
+        Read the records of a stream by position, decompressing only the chunks covering them
+
+        :param stream: the name of the stream (e.g. emg)
+        :param start: the position of the first record
+        :param stop: the position after the last record
+        :returns: a structured array
+        '''
+        arrays = []
+        position = 0
+        for entry in self.index:
+            if entry['stream'] != stream:
+                continue
+            end = position + entry['count']
+            if end > start and position < stop:
+                array = self._read_chunk(entry)
+                arrays.append(array[max(start - position, 0):stop - position])
+            position = end
+        if not arrays:
+            return np.empty(0, self.dtype(stream))
+        return np.concatenate(arrays)
+
+    def chunks(self, stream, start=None, end=None):
+        '''
+        Iterate over the decompressed chunks of a stream overlapping the given time range
+
+        :param stream: the name of the stream (e.g. emg)
+        :param start: the first timestamp of interest (the beginning if None)
+        :param end: the last timestamp of interest (the end if None)
+        :returns: a generator of structured arrays (restricted to the time range)
+        '''
+        for entry in self.index:
+            if entry['stream'] != stream:
+                continue
+            if (start is not None and entry['end'] < start) or \
+                    (end is not None and entry['start'] > end):
+                continue
+            array = self._read_chunk(entry)
+            if start is not None or end is not None:
+                timestamps = array['timestamp']
+                first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+                last = len(array) if end is None else np.searchsorted(timestamps, end, side='right')
+                array = array[first:last]
+            yield array
+
+    def _read_chunk(self, entry):
+        self._file.seek(entry['offset'])
+        _, description_len, data_len = CHUNK.unpack(self._file.read(CHUNK.size))
+        self._file.seek(description_len, 1)
+        data = CODECS[entry['codec']][1](self._file.read(data_len))
+        dtype = np.dtype([tuple(field) for field in entry['dtype']])
+        return decode(data, dtype, entry['count'])
+
+    def read(self, stream, start=None, end=None):
+        '''
+        Read the records of a stream within the given time range, decompressing only the chunks
+        covering it
+
+        :param stream: the name of the stream (e.g. emg)
+        :param start: the first timestamp of interest (the beginning if None)
+        :param end: the last timestamp of interest (the end if None)
+        :returns: a structured array
+        '''
+        arrays = list(self.chunks(stream, start, end))
+        if not arrays:
+            return np.empty(0, self.dtype(stream))
+        return np.concatenate(arrays)
+
+    def close(self):
+        self._file.close()
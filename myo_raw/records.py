@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Fixed-size binary layouts of the samples passed to the handlers of each data category'''
+
+import struct
+from . import Arm, DataCategory, EMGMode, Pose, XDirection
+
+# EMG values are stored as int32 to hold both the raw int8 and the smoothed uint16 values, missing
+# moving flags are stored as 255 and missing characteristic numbers as -1
+FORMATS = {
+    DataCategory.ARM: struct.Struct('<dBB'),
+    DataCategory.BATTERY: struct.Struct('<dB'),
+    DataCategory.EMG: struct.Struct('<d8iBb'),
+    DataCategory.IMU: struct.Struct('<d4h3h3h'),
+    DataCategory.POSE: struct.Struct('<dB'),
+    DataCategory.GAP: struct.Struct('<dd'),
+    DataCategory.LINK: struct.Struct('<dbHHHd'),
+    DataCategory.EMG_MODE: struct.Struct('<dBH'),
+    DataCategory.ONSET: struct.Struct('<dBBf'),
+    DataCategory.SPECTRUM: struct.Struct('<d8f8f8f'),
+}
+
+# NumPy structured dtypes with the same memory layout as the binary records
+_DTYPES = {
+    DataCategory.ARM: [('timestamp', '<f8'), ('arm', 'u1'), ('xdir', 'u1')],
+    DataCategory.BATTERY: [('timestamp', '<f8'), ('battery_level', 'u1')],
+    DataCategory.EMG: [('timestamp', '<f8'), ('emg', '<i4', (8,)), ('moving', 'u1'),
+                       ('characteristic_num', 'i1')],
+    DataCategory.IMU: [('timestamp', '<f8'), ('quat', '<i2', (4,)), ('acc', '<i2', (3,)),
+                       ('gyro', '<i2', (3,))],
+    DataCategory.POSE: [('timestamp', '<f8'), ('pose', 'u1')],
+    DataCategory.GAP: [('timestamp', '<f8'), ('duration', '<f8')],
+    DataCategory.LINK: [('timestamp', '<f8'), ('rssi', 'i1'), ('interval', '<u2'),
+                        ('latency', '<u2'), ('supervision_timeout', '<u2'),
+                        ('notification_rate', '<f8')],
+    DataCategory.EMG_MODE: [('timestamp', '<f8'), ('emg_mode', 'u1'), ('rate', '<u2')],
+    DataCategory.ONSET: [('timestamp', '<f8'), ('channel', 'u1'), ('onset', 'u1'),
+                         ('envelope', '<f4')],
+    DataCategory.SPECTRUM: [('timestamp', '<f8'), ('mean_frequency', '<f4', (8,)),
+                            ('median_frequency', '<f4', (8,)), ('power', '<f4', (8,))],
+}
+
+def _flatten_emg(timestamp, emg, moving, characteristic_num):
+    return (timestamp, *emg, 255 if moving is None else moving,
+            -1 if characteristic_num is None else characteristic_num)
+
+def _unflatten_emg(values):
+    return (values[0], values[1:9], None if values[9] == 255 else values[9],
+            None if values[10] == -1 else values[10])
+
+_FLATTEN = {
+    DataCategory.ARM: lambda timestamp, arm, xdir: (timestamp, arm.value, xdir.value),
+    DataCategory.BATTERY: lambda timestamp, level: (timestamp, level),
+    DataCategory.EMG: _flatten_emg,
+    DataCategory.IMU: lambda timestamp, quat, acc, gyro: (timestamp, *quat, *acc, *gyro),
+    DataCategory.POSE: lambda timestamp, pose: (timestamp, pose.value),
+    DataCategory.GAP: lambda timestamp, duration: (timestamp, duration),
+    DataCategory.LINK: lambda *values: values,
+    DataCategory.EMG_MODE: lambda timestamp, mode, rate: (timestamp, int(mode), rate),
+    DataCategory.ONSET: lambda timestamp, channel, onset, envelope: (timestamp, channel, int(onset),
+                                                                     envelope),
+    DataCategory.SPECTRUM: lambda timestamp, mean, median, power: (timestamp, *mean, *median,
+                                                                   *power),
+}
+
+_UNFLATTEN = {
+    DataCategory.ARM: lambda values: (values[0], Arm(values[1]), XDirection(values[2])),
+    DataCategory.BATTERY: tuple,
+    DataCategory.EMG: _unflatten_emg,
+    DataCategory.IMU: lambda values: (values[0], values[1:5], values[5:8], values[8:11]),
+    DataCategory.POSE: lambda values: (values[0], Pose(values[1])),
+    DataCategory.GAP: tuple,
+    DataCategory.LINK: tuple,
+    DataCategory.EMG_MODE: lambda values: (values[0], EMGMode(values[1]), values[2]),
+    DataCategory.ONSET: lambda values: (values[0], values[1], bool(values[2]), values[3]),
+    DataCategory.SPECTRUM: lambda values: (values[0], values[1:9], values[9:17], values[17:25]),
+}
+
+def record_size(category):
+    '''Return the size in bytes of a record of the given data category'''
+    return FORMATS[category].size
+
+def flatten(category, *data):
+    '''Return the handler arguments of a data category as a flat tuple of numbers'''
+    return _FLATTEN[category](*data)
+
+def pack(category, *data):
+    '''Pack the handler arguments of a data category into a record'''
+    return FORMATS[category].pack(*_FLATTEN[category](*data))
+
+def pack_into(category, buffer, offset, *data):
+    '''Pack the handler arguments of a data category into a writable buffer at the given offset'''
+    FORMATS[category].pack_into(buffer, offset, *_FLATTEN[category](*data))
+
+def unflatten(category, values):
+    '''Return the handler arguments of a data category from a flat tuple of numbers'''
+    return _UNFLATTEN[category](values)
+
+def unpack(category, buffer, offset=0):
+    '''Unpack a record into the handler arguments of its data category'''
+    return _UNFLATTEN[category](FORMATS[category].unpack_from(buffer, offset))
+
+def dtype(category):
+    '''Return the NumPy structured dtype of the records of a data category (requires NumPy)'''
+    import numpy as np
+    return np.dtype(_DTYPES[category])
+
+def as_array(category, buffer):
+    '''Return a structured array view of consecutive records without copying (requires NumPy)'''
+    import numpy as np
+    return np.frombuffer(buffer, dtype(category))
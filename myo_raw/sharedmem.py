@@ -0,0 +1,137 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Publish data categories into shared memory ring buffers readable by other local processes'''
+
+import struct
+import logging
+import threading
+from multiprocessing import shared_memory
+from . import DataCategory
+from . import records
+
+LOG = logging.getLogger(__name__)
+
+# serializes the temporary replacement of the resource tracker registration (see _attach)
+_ATTACH_LOCK = threading.Lock()
+
+# header: magic, category, record size, slot size, slot count and sequence number of the last record
+HEADER = struct.Struct('<8sIIIIQ')
+MAGIC = b'MYORING1'
+# every slot starts with the sequence number of its record (0 while being written)
+SLOT_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = HEADER.size - 8
+
+class SharedStreamWriter():
+    '''Single writer of a shared memory ring buffer holding records of one data category.'''
+
+    def __init__(self, category, name=None, slots=4096):
+        '''
+        :param category: the data category of the published records
+        :param name: the name of the shared memory block (chosen by the system if None)
+        :param slots: the number of records kept in the ring buffer
+        '''
+        self.category = category
+        self.slots = slots
+        self.record_size = records.record_size(category)
+        # align the slots to 8 bytes
+        self.slot_size = (SLOT_SEQ.size + self.record_size + 7) // 8 * 8
+        self.shm = shared_memory.SharedMemory(name, create=True,
+                                              size=HEADER.size + slots * self.slot_size)
+        self.name = self.shm.name
+        self.seq = 0
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, category.value, self.record_size, self.slot_size,
+                         slots, 0)
+        LOG.debug('publishing %s data in shared memory %s', category.name, self.name)
+
+    def write(self, *data):
+        '''Publish the handler arguments of a single sample'''
+        buf = self.shm.buf
+        seq = self.seq + 1
+        offset = HEADER.size + (seq - 1) % self.slots * self.slot_size
+        # invalidate the slot, write the record and publish it (seqlock)
+        SLOT_SEQ.pack_into(buf, offset, 0)
+        records.pack_into(self.category, buf, offset + SLOT_SEQ.size, *data)
+        SLOT_SEQ.pack_into(buf, offset, seq)
+        SLOT_SEQ.pack_into(buf, _SEQ_OFFSET, seq)
+        self.seq = seq
+
+    def close(self):
+        '''Close and remove the shared memory block'''
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStreamReader():
+    '''Read-only consumer of a shared memory ring buffer created by a SharedStreamWriter.'''
+
+    def __init__(self, name, from_start=False):
+        '''
+        :param name: the name of the shared memory block
+        :param from_start: if true read all records still in the buffer, otherwise only new ones
+        '''
+        self.shm = _attach(name)
+        self.buf = self.shm.buf.toreadonly()
+        magic, category, self.record_size, self.slot_size, self.slots, seq = \
+            HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a myo_raw shared memory stream' % name)
+        self.category = DataCategory(category)
+        self.seq = max(seq - self.slots, 0) if from_start else seq
+        self.lost = 0
+
+    def read(self, max_records=None):
+        '''
+        Return the records published since the last call (records overwritten before being read
+        are counted in the lost attribute)
+
+        :param max_records: the maximum number of records to return
+        :returns: a list of tuples of handler arguments
+        '''
+        buf = self.buf
+        last = SLOT_SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+        if last - self.seq > self.slots:
+            self.lost += last - self.seq - self.slots
+            self.seq = last - self.slots
+        if max_records is not None:
+            last = min(last, self.seq + max_records)
+        result = []
+        for seq in range(self.seq + 1, last + 1):
+            offset = HEADER.size + (seq - 1) % self.slots * self.slot_size
+            data = bytes(buf[offset + SLOT_SEQ.size:offset + SLOT_SEQ.size + self.record_size])
+            # discard the record if the writer has overwritten the slot while copying it
+            if SLOT_SEQ.unpack_from(buf, offset)[0] != seq:
+                self.lost += 1
+                continue
+            result.append(records.unpack(self.category, data))
+        self.seq = last
+        return result
+
+    def close(self):
+        '''Detach from the shared memory block'''
+        self.buf.release()
+        self.shm.close()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # before Python 3.13 attaching registers the block with the resource tracker, which removes it
+    # when the reader exits (unregistering afterwards would drop the registration of a writer
+    # sharing the tracker), hence the registration of this block is skipped
+    from multiprocessing import resource_tracker
+    with _ATTACH_LOCK:
+        register = resource_tracker.register
+        def register_others(registered, rtype):
+            if registered.lstrip('/') != name.lstrip('/'):
+                register(registered, rtype)
+        resource_tracker.register = register_others
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
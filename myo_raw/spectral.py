@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Short-time spectral analysis of the EMG stream (e.g. to monitor muscle fatigue)'''
+
+import logging
+import numpy as np
+from . import DataCategory, EMG_RATES, records
+
+LOG = logging.getLogger(__name__)
+
+class SpectralAnalyzer():
+    '''
+    Compute the spectra of overlapping windows of the EMG stream and derive the mean frequency,
+    the median frequency and the power of each channel. All channels of a window are transformed
+    by a single FFT. The sample, window and power buffers are allocated in advance, so a hop only
+    allocates the FFT output and a few values per channel.
+    '''
+
+    def __init__(self, myo=None, rate=None, window=256, hop=50):
+        '''
+        :param myo: the subscribed MyoRaw instance (None to only process samples with feed)
+        :param rate: the EMG sampling rate (the rate of the subscribed EMG mode of myo if None)
+        :param window: the number of samples per (Hann tapered) window
+        :param hop: the number of samples between the ends of two windows
+        '''
+        if rate is None:
+            rate = EMG_RATES[myo.subscription['emg_mode']]
+        if not 0 < hop <= window:
+            raise ValueError('hop must be between 1 and the window size')
+        self.myo = myo
+        self.window = window
+        self.hop = hop
+        self.spectra = 0
+        self._taper = np.hanning(window)[:, np.newaxis]
+        # scale the power of the tapered window to the mean square of the signal
+        self._scale = 2.0 / (window * (self._taper ** 2).sum())
+        # every sample is written twice, so the latest window is always a contiguous slice
+        self._samples = np.zeros((2 * window, 8))
+        self._frame = np.empty((window, 8))
+        self._power = np.empty((window // 2 + 1, 8))
+        self._imag_power = np.empty_like(self._power)
+        self._cumulative = np.empty_like(self._power)
+        self._configure(rate)
+
+    def attach(self, inline=True, budget=None):
+        '''
+        Register the analyzer as EMG and EMG_MODE handler of its MyoRaw instance
+
+        :param inline: if true run the analysis in the receive thread (see MyoRaw.add_handler)
+        :param budget: the time budget per EMG sample in seconds of an inline analyzer
+        '''
+        self.myo.add_handler(DataCategory.EMG, self, inline=inline, budget=budget)
+        self.myo.add_handler(DataCategory.EMG_MODE, self.on_emg_mode, inline=inline)
+
+    def _configure(self, rate):
+        self.rate = rate
+        self.frequencies = np.fft.rfftfreq(self.window, 1.0 / rate)
+        self.reset()
+
+    def reset(self):
+        '''Discard the buffered samples'''
+        self._position = 0
+        self._filled = 0
+        self._since = 0
+
+    def on_emg_mode(self, timestamp, emg_mode, rate):
+        '''Handler of EMG mode changes (restarting the analysis at the new rate)'''
+        if rate:
+            LOG.debug('restarting spectral analysis at %d Hz', rate)
+            self._configure(rate)
+
+    def __call__(self, timestamp, emg, moving, characteristic_num):
+        '''Handler of EMG samples'''
+        position = self._position
+        self._samples[position] = emg
+        self._samples[position + self.window] = emg
+        self._advance(1)
+        if self._ready():
+            self.myo._emit(DataCategory.SPECTRUM, timestamp, *self._analyze())
+
+    def feed(self, timestamps, emg):
+        '''
+        Process consecutive samples (e.g. of a recording) and return the spectral features
+
+        :param timestamps: the timestamps of the samples
+        :param emg: the EMG values of the samples with shape (n, 8)
+        :returns: a structured array (see records.dtype(DataCategory.SPECTRUM)) stamped with the
+          time of the last sample of each window
+        '''
+        emg = np.asarray(emg)
+        result = np.zeros(len(emg) // self.hop + 1, records.dtype(DataCategory.SPECTRUM))
+        count = 0
+        start = 0
+        while start < len(emg):
+            # copy the samples up to the end of the next window at once
+            missing = max(self.window - self._filled, self.hop - self._since)
+            block = emg[start:start + min(missing, self.window - self._position)]
+            self._samples[self._position:self._position + len(block)] = block
+            self._samples[self._position + self.window:][:len(block)] = block
+            self._advance(len(block))
+            start += len(block)
+            if self._ready():
+                row = result[count]
+                row['timestamp'] = timestamps[start - 1]
+                row['mean_frequency'], row['median_frequency'], row['power'] = self._analyze()
+                count += 1
+        return result[:count]
+
+    def _advance(self, count):
+        self._position = (self._position + count) % self.window
+        self._filled = min(self._filled + count, self.window)
+        self._since += count
+
+    def _ready(self):
+        if self._filled < self.window or self._since < self.hop:
+            return False
+        self._since = 0
+        return True
+
+    def _analyze(self):
+        frame = self._frame
+        latest = self._samples[self._position:self._position + self.window]
+        np.subtract(latest, latest.mean(axis=0), out=frame)
+        frame *= self._taper
+        spectrum = np.fft.rfft(frame, axis=0)
+        # the squared magnitude without the square root of np.abs
+        power = np.square(spectrum.real, out=self._power)
+        power += np.square(spectrum.imag, out=self._imag_power)
+        total = power.sum(axis=0)
+        valid = total > 0
+        total[~valid] = 1.0
+        mean = self.frequencies @ power / total
+        np.cumsum(power, axis=0, out=self._cumulative)
+        median = self.frequencies[(self._cumulative < total / 2).sum(axis=0)]
+        mean[~valid] = median[~valid] = 0.0
+        total[~valid] = 0.0
+        self.spectra += 1
+        return tuple(mean.tolist()), tuple(median.tolist()), tuple((total * self._scale).tolist())
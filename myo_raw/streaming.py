@@ -0,0 +1,617 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+'''Republish the data of a Myo armband to multiple TCP or Unix socket subscribers'''
+
+import argparse
+import collections
+import json
+import logging
+import os
+import select
+import socket
+import stat
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from . import DataCategory, EMGMode, MyoRaw
+from . import records
+from .consumerpool import ConsumerPool
+from .hooks import HookPoint, Hooks
+
+LOG = logging.getLogger(__name__)
+
+# subscription sent by a client after connecting: magic and bitmask of the requested categories
+HELLO = struct.Struct('<4sI')
+MAGIC = b'MYOS'
+# frame header: category, number of records, sequence number of the first record
+FRAME = struct.Struct('<BHQ')
+# frame category of the undecoded notifications (beyond the values of the data categories)
+NOTIFICATIONS = 31
+# notification record: arrival time, attribute, payload length and payload (at most 20 bytes)
+NOTIFICATION = struct.Struct('<dHB20s')
+# answer to a subscription including NOTIFICATIONS: length of the JSON encoded device info
+INFO = struct.Struct('<I')
+
+def _create_socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    return socket.socket(family, socket.SOCK_STREAM)
+
+def _category_mask(data_categories):
+    return sum(1 << category.value for category in data_categories or DataCategory)
+
+
+class Subscriber():
+    '''A connected client with its own handshake, bounded send queue and sender thread.'''
+
+    def __init__(self, sock, address, info, max_backlog):
+        '''
+        :param sock: the accepted socket
+        :param address: the address of the client
+        :param info: function returning the device info sent to subscribers of the notifications
+        :param max_backlog: the maximum number of queued frames before dropping
+        '''
+        self.sock = sock
+        self.address = address
+        # no frames are queued before the handshake has been completed
+        self.mask = 0
+        self.dropped = 0
+        self._info = info
+        self._frames = collections.deque()
+        self._max_backlog = max_backlog
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._running
+
+    def enqueue(self, frame):
+        '''Queue a frame to be sent (dropped if the subscriber is too slow to keep up)'''
+        with self._cond:
+            if len(self._frames) >= self._max_backlog:
+                self.dropped += 1
+                return
+            self._frames.append(frame)
+            self._cond.notify()
+
+    def _serve(self):
+        if self._handshake():
+            self._send_frames()
+        self._running = False
+        self.sock.close()
+
+    def _handshake(self):
+        try:
+            self.sock.settimeout(5)
+            magic, mask = HELLO.unpack(_recv_exactly(self.sock, HELLO.size))
+            if magic != MAGIC:
+                LOG.warning('rejected subscriber %s (invalid handshake)', self.address)
+                return False
+            if mask & 1 << NOTIFICATIONS:
+                # MyoRaw instances of subscribers read the device info instead of attributes
+                info = json.dumps(self._info())
+                self.sock.sendall(INFO.pack(len(info)) + info.encode('utf-8'))
+            self.sock.settimeout(None)
+        except (OSError, struct.error, EOFError) as err:
+            if self._running:
+                LOG.warning('rejected subscriber %s (%s)', self.address, err)
+            return False
+        LOG.info('new subscriber %s', self.address or 'on Unix socket')
+        self.mask = mask
+        return True
+
+    def _send_frames(self):
+        while self._running:
+            with self._cond:
+                self._cond.wait_for(lambda: self._frames or not self._running)
+                frames = list(self._frames)
+                self._frames.clear()
+            try:
+                # coalesce all pending frames into a single write
+                self.sock.sendall(b''.join(frames))
+            except OSError as err:
+                LOG.info('subscriber %s disconnected (%s)', self.address, err)
+                self._running = False
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        # interrupt a blocking send to a stalled client
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._thread.join()
+
+
+class StreamServer():
+    '''
+    Republish the decoded data and the notifications of a MyoRaw instance in batched binary
+    frames.
+    '''
+
+    def __init__(self, myo, address, batch_size=32, flush_interval=0.01, max_backlog=256):
+        '''
+        :param myo: the connected MyoRaw instance (owned by the caller)
+        :param address: a (host, port) tuple for TCP or a path for a Unix socket
+        :param batch_size: the maximum number of records per frame
+        :param flush_interval: the maximum time records are held back to fill a frame
+        :param max_backlog: the maximum number of frames queued per subscriber before dropping
+        '''
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.subscribers = []
+        self._myo = myo
+        # read once as the receive thread of the caller must not be interrupted later on
+        self._info = {'mac': myo.mac, 'version': list(myo.version), 'name': myo.get_name(),
+                      'battery': myo.get_battery_level()}
+        self._lock = threading.Lock()
+        frame_categories = [category.value for category in DataCategory] + [NOTIFICATIONS]
+        self._batches = {value: bytearray() for value in frame_categories}
+        self._counts = dict.fromkeys(frame_categories, 0)
+        self._seqs = dict.fromkeys(frame_categories, 0)
+        self._running = True
+        self.sock = _create_socket(address)
+        if isinstance(address, str):
+            # remove a stale socket file of a previous server
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        for category in DataCategory:
+            myo.add_handler(category, self._handler(category))
+        # forward the notifications as well to be decoded by MyoRaw instances of subscribers
+        myo.hooks.add(HookPoint.NOTIFICATION_DECODED, self._on_notification)
+        self._threads = [threading.Thread(target=self._accept, daemon=True),
+                         threading.Thread(target=self._flush_periodically, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        LOG.info('streaming on %s', self.address)
+
+    def _handler(self, category):
+        record_format = records.FORMATS[category]
+        def handle(*data):
+            with self._lock:
+                self._append(category.value, record_format.pack(*records.flatten(category, *data)))
+        return handle
+
+    def _on_notification(self, cur_time, attr, pay):
+        with self._lock:
+            self._append(NOTIFICATIONS, NOTIFICATION.pack(cur_time, attr, len(pay), pay))
+
+    def _append(self, frame_category, record):
+        # called with the lock held
+        self._batches[frame_category] += record
+        self._counts[frame_category] += 1
+        if self._counts[frame_category] >= self.batch_size:
+            self._flush(frame_category)
+
+    def _flush(self, frame_category):
+        # called with the lock held
+        count = self._counts[frame_category]
+        if not count:
+            return
+        frame = FRAME.pack(frame_category, count, self._seqs[frame_category]) + \
+            self._batches[frame_category]
+        self._seqs[frame_category] += count
+        self._counts[frame_category] = 0
+        self._batches[frame_category] = bytearray()
+        bit = 1 << frame_category
+        for subscriber in self.subscribers:
+            if subscriber.mask & bit:
+                subscriber.enqueue(frame)
+
+    def _flush_periodically(self):
+        while self._running:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                for frame_category in self._batches:
+                    self._flush(frame_category)
+                self.subscribers = [sub for sub in self.subscribers if sub.alive]
+
+    def _accept(self):
+        while self._running:
+            try:
+                sock, address = self.sock.accept()
+            except OSError:
+                return
+            # the handshake runs in the thread of the subscriber to never delay accepting others
+            with self._lock:
+                self.subscribers.append(Subscriber(sock, address, self._device_info,
+                                                   self.max_backlog))
+
+    def _device_info(self):
+        return dict(self._info, subscription=self._myo.subscription)
+
+    def close(self):
+        '''Stop accepting subscribers and disconnect all of them'''
+        self._running = False
+        # shutting down the listening socket interrupts the blocking accept
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if isinstance(self.address, str):
+            os.unlink(self.address)
+        for thread in self._threads:
+            thread.join()
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers.clear()
+
+
+class StreamClient():
+    '''Receive the data of a StreamServer through the same handler interface as MyoRaw.'''
+
+    def __init__(self, address, data_categories=None):
+        '''
+        :param address: a (host, port) tuple for TCP or a path for a Unix socket
+        :param data_categories: the data categories to be received (all if None)
+        '''
+        self.sock = _create_socket(address)
+        self.sock.connect(address)
+        self.sock.sendall(HELLO.pack(MAGIC, _category_mask(data_categories)))
+        self.cpool = ConsumerPool(DataCategory)
+        self.lost = 0
+        self._buf = bytearray()
+        self._next_seqs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.disconnect()
+
+    def run(self, timeout=None):
+        '''
+        Block until data is received or until the given timeout has elapsed
+
+        :param timeout: the maximum amount of time to wait for data
+        '''
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(1 << 16)
+        except socket.timeout:
+            return
+        if not data:
+            raise EOFError('the stream server closed the connection')
+        self._buf += data
+        self._parse_frames()
+
+    def _parse_frames(self):
+        buf, offset = self._buf, 0
+        while len(buf) - offset >= FRAME.size:
+            category_value, count, seq = FRAME.unpack_from(buf, offset)
+            category = DataCategory(category_value)
+            record_format = records.FORMATS[category]
+            end = offset + FRAME.size + count * record_format.size
+            if len(buf) < end:
+                break
+            # records dropped by the server for this slow subscriber show up as sequence gaps
+            self.lost += seq - self._next_seqs.get(category, seq)
+            self._next_seqs[category] = seq + count
+            for values in record_format.iter_unpack(buf[offset + FRAME.size:end]):
+                self.cpool.enqueue_data(category, *records.unflatten(category, values))
+            offset = end
+        del buf[:offset]
+
+    def disconnect(self):
+        '''Disconnect from the stream server'''
+        self.cpool.shutdown()
+        self.sock.close()
+
+    def add_handler(self, data_category, handler):
+        '''
+        Add a handler to process data of a specific category
+
+        :param data_category: data category of the handler function
+        :param handler: function to be called
+        '''
+        self.cpool.add_callback(data_category, handler)
+
+    def pop_handler(self, data_category, index=-1):
+        '''
+        Remove and return the handler of a specific data category at index (default last)
+
+        :param data_category: data category of the handler function
+        :param index: index of the handler to be removed and returned
+        :returns: the removed handler
+        '''
+        return self.cpool.pop_callback(data_category, index)
+
+    def clear_handler(self, data_category):
+        '''
+        Remove all handlers of a given data category
+
+        :param data_category: data category of the handler function
+        '''
+        self.cpool.clear_callbacks(data_category)
+
+
+class StreamBackend():
+    '''
+    Backend receiving the notifications of the armband of a StreamServer instead of a Bluetooth
+    adapter (registered as 'stream'), so that MyoRaw decodes them with all of its features. The
+    armband is controlled by the server only, hence writes (e.g. subscribing or setting the
+    LEDs) are ignored, the device info is read from the server and the notifications keep their
+    arrival time at the server. After losing the server MyoRaw reconnects to it like to an armband.
+    '''
+
+    def __init__(self, address, timeout=5):
+        '''
+        :param address: a (host, port) tuple for TCP or a path for a Unix socket
+        :param timeout: the maximum amount of time to connect and to receive the device info
+        '''
+        self.address = address
+        self.timeout = timeout
+        self.handler = None
+        self.disconnect_handler = None
+        self.hooks = Hooks()
+        self.notifications = 0
+        self.lost = 0
+        self._connecting = None
+        self._open()
+        LOG.debug('using stream backend (%s)', address)
+
+    def _open(self):
+        sock = _create_socket(self.address)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            sock.sendall(HELLO.pack(MAGIC, 1 << NOTIFICATIONS))
+            size, = INFO.unpack(_recv_exactly(sock, INFO.size))
+            info = json.loads(_recv_exactly(sock, size).decode('utf-8'))
+            sock.setblocking(False)
+        except BaseException:
+            sock.close()
+            raise
+        # the device info of the armband including the subscription of the server
+        self.info = info
+        self.subscription = info['subscription']
+        self._buf = bytearray()
+        self._next_seq = None
+        self.sock = sock
+
+    def scan(self, target_uuid, target_address=None, timeout=None):
+        if target_address is not None and target_address.lower() != self.info['mac'].lower():
+            LOG.warning('the stream server provides %s instead of %s', self.info['mac'],
+                        target_address)
+            return None
+        return self.info['mac']
+
+    def connect(self, target_address, timeout=None, params=None):
+        # already connected to the server when created
+        if params is not None:
+            LOG.debug('connection parameters are set by the stream server')
+
+    def submit_connect(self, target_address, params=None):
+        '''
+        Reconnect to the server in a background thread
+
+        :returns: a future resolved once connected (the pending one if already connecting)
+        '''
+        if self._connecting is not None:
+            return self._connecting[1]
+        connected = Future()
+        def connect():
+            try:
+                self._open()
+            except (OSError, EOFError, ValueError) as err:
+                connected.set_exception(err)
+            else:
+                connected.set_result(None)
+            finally:
+                self._connecting = None
+        thread = threading.Thread(target=connect, name='stream connect', daemon=True)
+        self._connecting = (thread, connected)
+        thread.start()
+        return connected
+
+    @staticmethod
+    def cancel_connect(connected):
+        # a connection attempt fails on its own timeout
+        pass
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        # nothing left to release after disconnecting from the server
+        pass
+
+    @staticmethod
+    def update_connection(params):
+        raise NotImplementedError('the connection parameters are set by the stream server')
+
+    @staticmethod
+    def submit_rssi():
+        raise NotImplementedError('the link is monitored by the stream server')
+
+    @staticmethod
+    def submit_connection_status():
+        raise NotImplementedError('the link is monitored by the stream server')
+
+    def fileno(self):
+        '''Return the file descriptor of the socket connected to the server'''
+        return self.sock.fileno()
+
+    def recv_packet(self, timeout=None):
+        connecting = self._connecting
+        if connecting is not None:
+            # the server is being reconnected in the background
+            connecting[0].join(timeout)
+            return
+        if self.sock is None:
+            self._on_error(EOFError('not connected to the stream server'))
+            return
+        if select.select([self.sock], [], [], timeout)[0]:
+            self._receive()
+
+    def pump(self):
+        '''
+        Process all notifications received so far without blocking
+
+        :returns: the number of handled notifications
+        '''
+        if self._connecting is not None or self.sock is None:
+            return 0
+        notifications = self.notifications
+        self._receive()
+        return self.notifications - notifications
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                break
+            except OSError as err:
+                data, error = None, err
+            else:
+                error = EOFError('the stream server closed the connection')
+            if not data:
+                self.sock.close()
+                self.sock = None
+                self._on_error(error)
+                break
+            self._buf += data
+        self._handle(self._parse_frames())
+
+    def _parse_frames(self):
+        buf, offset = self._buf, 0
+        notifications = []
+        while len(buf) - offset >= FRAME.size:
+            _, count, seq = FRAME.unpack_from(buf, offset)
+            end = offset + FRAME.size + count * NOTIFICATION.size
+            if len(buf) < end:
+                break
+            # notifications dropped by the server for this slow subscriber show up as gaps
+            if self._next_seq is not None:
+                self.lost += seq - self._next_seq
+            self._next_seq = seq + count
+            for cur_time, attr, size, pay in NOTIFICATION.iter_unpack(buf[offset + FRAME.size:end]):
+                notifications.append((attr, pay[:size], cur_time))
+            offset = end
+        del buf[:offset]
+        return notifications
+
+    def _handle(self, notifications):
+        if not notifications:
+            return
+        hooks = self.hooks.frame_received
+        if hooks:
+            for notification in notifications:
+                for hook in hooks:
+                    hook(notification)
+        self.notifications += len(notifications)
+        if self.handler is not None:
+            self.handler(notifications)
+
+    def _on_error(self, err):
+        if self.disconnect_handler is None:
+            raise err
+        LOG.warning('connection to the stream server lost (%s)', err)
+        self.disconnect_handler(err)
+
+    def read_attr(self, attr):
+        # the attributes read by MyoRaw are served from the device info
+        if attr == 0x17:
+            return struct.pack('<HHHH', *self.info['version'])
+        if attr == 0x03:
+            return self.info['name'].encode('utf-8')
+        if attr == 0x11:
+            return struct.pack('<B', self.info['battery'])
+        raise NotImplementedError('attribute %02X is not provided by the stream server' % attr)
+
+    @staticmethod
+    def write_attr(attr, val, wait_response=True):
+        LOG.debug('ignoring write to %02X (the armband is controlled by the server)', attr)
+
+    def submit_read_attr(self, attr):
+        return self._completed(self.read_attr, attr)
+
+    def submit_write_attr(self, attr, val, wait_response=True):
+        return self._completed(self.write_attr, attr, val, wait_response)
+
+    @staticmethod
+    def wait(futures, timeout=None):
+        # all procedures are answered locally, hence all futures are already resolved
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _completed(func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except NotImplementedError as err:
+            future.set_exception(err)
+        return future
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('connection closed')
+        data += chunk
+    return data
+
+def parse_address(address):
+    '''Parse host:port into a TCP address tuple, anything else is used as a Unix socket path'''
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '0.0.0.0', int(port))
+    return address
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--tty', default=None, help='The Myo dongle device (autodetected if omitted)')
+    group.add_argument('--native', default=False, action='store_true',
+                       help='Use a native Bluetooth stack')
+    parser.add_argument('--mac', default=None,
+                        help='The Myo MAC address (arbitrarily detected if omitted)')
+    modes = ', '.join([str(item.value) + ': ' + item.name for item in EMGMode])
+    parser.add_argument('--emg_mode', type=int, default=EMGMode.RAW,
+                        choices=[m.value for m in EMGMode],
+                        help='Choose the EMG receiving mode ({0} - default: %(default)s)'.format(modes))
+    parser.add_argument('-l', '--listen', default='127.0.0.1:7117',
+                        help='host:port or Unix socket path to listen on (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Increase verbosity')
+    args = parser.parse_args()
+    logging.basicConfig(level=max(2 - args.verbose, 0) * 10)
+
+    myo = MyoRaw(args.tty, args.native, args.mac)
+    server = StreamServer(myo, parse_address(args.listen))
+    myo.subscribe(args.emg_mode)
+    myo.set_sleep_mode(1)
+    myo.vibrate(1)
+    try:
+        while True:
+            myo.run(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        myo.disconnect()
+        print('Disconnected')
+
+if __name__ == '__main__':
+    main()
@@ -25,12 +25,20 @@ setup(
     license='MIT',
     packages=['myo_raw',],
     install_requires=['pyserial>=3.4',],
-    python_requires='>=3.3',
+    python_requires='>=3.8',
     extras_require={
-        'native':['bluepy>=1.1.4',],
+        'native':['bluepy>=1.3.0',],
+        'numpy':['numpy>=1.13.3',],
         'emg':['pygame>=1.9.3',],
         'classification':['numpy>=1.13.3', 'pygame>=1.9.3', 'scikit-learn>=0.19.1',],
     },
+    entry_points={
+        'console_scripts': [
+            'myo-stream-server=myo_raw.streaming:main',
+            'myo-record=myo_raw.recorder:main',
+            'myo-batch=myo_raw.batch:main',
+        ],
+    },
     keywords='thalmic myo EMG electromyography IMU inertial measurement unit',
     platforms='any',
     classifiers=[
@@ -38,6 +46,12 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Intended Audience :: Science/Research',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
 )
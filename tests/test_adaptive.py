@@ -0,0 +1,114 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import struct
+import unittest
+from concurrent.futures import Future
+
+from myo_raw import MyoRaw, DataCategory, EMGMode
+from myo_raw.adaptive import AdaptiveEMGController
+from myo_raw.backends import register_backend
+from myo_raw.hooks import Hooks
+
+
+class StubBackend():
+    '''Backend answering every request at once which fails writes while the link is down'''
+
+    def __init__(self):
+        self.conn = 0
+        self.writes = []
+        self.connecting = None
+        self.handler = None
+        self.disconnect_handler = None
+        self.hooks = Hooks()
+        self.notifications = 0
+
+    @staticmethod
+    def scan(target_uuid, target_address=None, timeout=None):
+        return '01:02:03:04:05:06'
+
+    def connect(self, target_address, timeout=None, params=None):
+        self.conn = 0
+
+    def submit_read_attr(self, attr):
+        values = {0x17: struct.pack('<HHHH', 1, 5, 1970, 2), 0x03: b'stub', 0x11: b'\x55'}
+        return self._completed(values[attr])
+
+    def submit_write_attr(self, attr, val, wait_response=True):
+        # the BLED112 backend fails to pack the command without a connection handle
+        payload = struct.pack('<BH', self.conn, attr)
+        self.writes.append((attr, val))
+        return self._completed(payload)
+
+    def submit_connect(self, target_address, params=None):
+        self.connecting = Future()
+        return self.connecting
+
+    def lose(self):
+        self.conn = None
+        self.disconnect_handler(0x208)
+
+    def reconnect(self):
+        self.conn = 0
+        self.connecting.set_result(None)
+
+    @staticmethod
+    def wait(futures, timeout=None):
+        return [future.result() for future in futures]
+
+    def pump(self):
+        return 0
+
+    @staticmethod
+    def _completed(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+
+class SwitchWhileLinkLostTest(unittest.TestCase):
+
+    def setUp(self):
+        register_backend('stub', StubBackend)
+        self.myo = MyoRaw(backend='stub')
+        self.myo.subscribe(emg_mode=EMGMode.SMOOTHED)
+        self.backend = self.myo.backend
+        self.modes = []
+        self.myo.add_handler(DataCategory.EMG_MODE, lambda *data: self.modes.append(data[1:]),
+                             inline=True)
+        self.controller = AdaptiveEMGController(self.myo, rise_threshold=100)
+        self.controller.attach()
+
+    def activity(self):
+        for i in range(10):
+            self.controller(1.0 + i * 0.02, (500,) * 8, False, None)
+
+    def tearDown(self):
+        self.myo.cpool.shutdown()
+
+    def test_switch_is_replayed_on_reconnecting(self):
+        self.backend.lose()
+        self.activity()
+        self.assertEqual(self.controller.switches, 1)
+        self.assertEqual(self.myo.subscription['emg_mode'], EMGMode.RAW)
+        self.assertEqual(self.modes, [])
+
+        self.backend.writes.clear()
+        self.myo.pump()
+        self.backend.reconnect()
+        self.assertIsNone(self.myo._link_lost)
+        self.assertIn((0x19, b'\x01\x03\x03\x01\x01'), self.backend.writes)
+        self.assertIn((0x2c, b'\x01\x00'), self.backend.writes)
+        self.assertEqual(self.modes, [(EMGMode.RAW, 200)])
+
+    def test_switch_while_connected(self):
+        self.activity()
+        self.assertEqual(self.backend.writes[-1], (0x19, b'\x01\x03\x03\x01\x01'))
+        self.assertEqual(self.modes, [(EMGMode.RAW, 200)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2018 Matthias Gazzari
+#
+# Licensed under the MIT license. See the LICENSE file for details.
+#
+
+import io
+import os
+import threading
+import unittest
+
+from myo_raw import native
+from myo_raw.native import Native, MAX_BATCH, BTLEDisconnectError
+
+
+class StreamingStub():
+    '''Stub peripheral without a helper process which always has another notification pending'''
+
+    def __init__(self):
+        self.delegate = None
+        self.calls = 0
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+
+    def waitForNotifications(self, timeout):
+        if not timeout:
+            raise AssertionError('bluepy blocks without a positive timeout')
+        self.calls += 1
+        self.delegate.handleNotification(0x2b, bytes(16))
+        return True
+
+
+class QueueStub(StreamingStub):
+    '''Stub peripheral without a helper process delivering a fixed list of notifications'''
+
+    def __init__(self, count, error=None):
+        super().__init__()
+        self.count = count
+        self.error = error
+
+    def waitForNotifications(self, timeout):
+        if not timeout:
+            raise AssertionError('bluepy blocks without a positive timeout')
+        if not self.count:
+            if self.error is not None:
+                raise self.error
+            return False
+        self.count -= 1
+        self.delegate.handleNotification(0x2b, bytes(16))
+        return True
+
+
+class Helper():
+    '''Stand-in for the bluepy helper process writing notification lines into a pipe'''
+
+    def __init__(self):
+        fd_read, self.fd_write = os.pipe()
+        self.stdout = io.TextIOWrapper(io.open(fd_read, 'rb'))
+
+    def notify(self, count):
+        os.write(self.fd_write, b'rsp=$ntfy\n' * count)
+
+    def poll(self):
+        return None
+
+
+class HelperStub(StreamingStub):
+    '''Stub peripheral reading its helper output the way bluepy does'''
+
+    def __init__(self):
+        super().__init__()
+        self._helper = Helper()
+
+    def waitForNotifications(self, timeout):
+        # bluepy only polls the pipe for a positive timeout and otherwise blocks in readline
+        if timeout:
+            raise AssertionError('the backend should wait on the helper output itself')
+        self.calls += 1
+        self._helper.stdout.readline()
+        self.delegate.handleNotification(0x2b, bytes(16))
+        return True
+
+
+class RecvPacketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def backend(self, peripheral):
+        backend = Native(peripheral)
+        backend.handler = lambda batch: self.batches.append(batch)
+        return backend
+
+    def test_streaming_stub_returns_a_bounded_batch(self):
+        backend = self.backend(StreamingStub())
+        for _ in range(3):
+            backend.recv_packet(1)
+        self.assertEqual([len(batch) for batch in self.batches], [MAX_BATCH] * 3)
+        self.assertEqual(backend.notifications, 3 * MAX_BATCH)
+
+    def test_pending_notifications_form_one_batch(self):
+        backend = self.backend(QueueStub(5))
+        backend.recv_packet(1)
+        self.assertEqual([len(batch) for batch in self.batches], [5])
+        backend.recv_packet(0.01)
+        self.assertEqual(len(self.batches), 1)
+
+    def test_disconnect_passes_on_the_batch(self):
+        errors = []
+        backend = self.backend(QueueStub(3, BTLEDisconnectError('disconnected')))
+        backend.disconnect_handler = errors.append
+        backend.recv_packet(1)
+        self.assertEqual([len(batch) for batch in self.batches], [3])
+        self.assertEqual(len(errors), 1)
+
+    def test_helper_lines_read_ahead_are_drained(self):
+        peripheral = HelperStub()
+        backend = self.backend(peripheral)
+        peripheral._helper.notify(MAX_BATCH + 10)
+        backend.recv_packet(1)
+        # the remaining lines were read ahead from the pipe and are no longer visible to select
+        self.assertTrue(peripheral._helper.stdout.pending())
+        backend.recv_packet(0)
+        self.assertEqual([len(batch) for batch in self.batches], [MAX_BATCH, 10])
+
+    def test_helper_without_notifications_times_out(self):
+        peripheral = HelperStub()
+        backend = self.backend(peripheral)
+        timer = threading.Timer(0.05, peripheral._helper.notify, (1,))
+        timer.start()
+        backend.recv_packet(0.01)
+        self.assertEqual(self.batches, [])
+        backend.recv_packet(1)
+        timer.join()
+        self.assertEqual([len(batch) for batch in self.batches], [1])
+        self.assertEqual(peripheral.calls, 1)
+
+    def test_disconnected_helper(self):
+        errors = []
+        peripheral = HelperStub()
+        backend = self.backend(peripheral)
+        backend.disconnect_handler = errors.append
+        peripheral._helper = None
+        backend.recv_packet(0)
+        self.assertIsInstance(errors[0], native.BTLEDisconnectError)
+
+
+class PumpTest(unittest.TestCase):
+
+    def test_pump_drains_lines_read_ahead(self):
+        peripheral = HelperStub()
+        backend = Native(peripheral)
+        peripheral._helper.notify(3 * MAX_BATCH + 5)
+        self.assertEqual(backend.pump(), 3 * MAX_BATCH + 5)
+        self.assertFalse(peripheral._helper.stdout.pending())
+        self.assertEqual(backend.pump(), 0)
+
+    def test_pump_returns_on_a_streaming_stub(self):
+        backend = Native(StreamingStub())
+        self.assertEqual(backend.pump(), MAX_BATCH)
+
+    def test_fileno(self):
+        peripheral = HelperStub()
+        backend = Native(peripheral)
+        self.assertEqual(backend.fileno(), peripheral._helper.stdout.fileno())
+        with self.assertRaises(NotImplementedError):
+            Native(StreamingStub()).fileno()
+
+
+if __name__ == '__main__':
+    unittest.main()